@@ -0,0 +1,238 @@
+"""ballot_validation.py
+
+Implements a validation and canonicalization stage that runs before any tally.
+
+The mechanisms trust their input: PercentageAllocationWeightedPlurality does not check that
+ballots sum to 1.0, RankAndSlide divides by zero on an empty ballot, and a ballot from a voter
+that is missing from the voters dictionary fails with an AttributeError. validate_ballots checks
+the whole ballot set at once. It returns the accepted ballots as a normalized (voters x candidates)
+matrix, and the reasons why every other ballot was rejected.
+
+Reading the ballot dictionaries is the only loop over entries. Every check is a mask over the
+ballot matrix, so validating costs about as much as building the matrix. A pipeline that builds
+an Electorate anyway can pass it in, and only the masks are left to compute.
+"""
+
+from dataclasses import dataclass, field, replace
+from itertools import compress
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+from mechanisms.electorate import Electorate, _as_ballot
+
+# Why a ballot can be rejected, in the order they are checked
+REJECTION_REASONS = ["unknown_voter",       # The voter is not in the voters dictionary
+                     "candidate_voter",     # The voter stands as a candidate and may not vote
+                     "unknown_candidate",   # Something is given to a candidate that is not standing
+                     "not_a_number",        # An amount is NaN, infinite or not a number
+                     "negative",            # An amount is negative
+                     "empty",               # The amounts add up to 0
+                     "wrong_total"]         # The amounts do not add up to the expected total
+
+DEFAULT_TOLERANCE = 1e-5
+
+
+@dataclass
+class ValidatedBallots:
+    """
+    The ballots that passed validation, in canonical form, and a report of the rest.
+
+    Attributes:
+        voter_ids (List[str]): The voters whose ballots were accepted, in row order.
+        candidates (List[str]): The candidates, in column order of ballot_matrix.
+        ballot_matrix (np.ndarray): An (accepted voters x candidates) array. Each row sums to 1.
+        totals (np.ndarray): What each accepted ballot added up to before normalizing.
+        rejections (Dict[str, List[str]]): For each rejected voter, every reason that applies,
+            see REJECTION_REASONS.
+    """
+    voter_ids: List[str]
+    candidates: List[str]
+    ballot_matrix: np.ndarray
+    totals: np.ndarray
+    rejections: Dict[str, List[str]] = field(default_factory=dict)
+
+    def rejection_counts(self) -> Dict[str, int]:
+        """Returns how many ballots were rejected for each reason."""
+        counts = {reason: 0 for reason in REJECTION_REASONS}
+        for reasons in self.rejections.values():
+            for reason in reasons:
+                counts[reason] += 1
+        return counts
+
+    def to_dicts(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the accepted ballots as {voter: {candidate: proportion}}, leaving out zero entries.
+        This is the voter_choices form of PercentageAllocationWeightedPlurality and RankAndSlide.
+        """
+        return {voter: {candidate: float(proportion)
+                        for candidate, proportion in zip(self.candidates, row) if proportion}
+                for voter, row in zip(self.voter_ids, self.ballot_matrix)}
+
+    def electorate(self,
+                   voter_credentials: Union[Dict[str, Dict[str, Any]], Electorate],
+                   credentials: Optional[List[str]] = None) -> Electorate:
+        """
+        Builds the Electorate of the accepted voters, with the normalized ballots.
+
+        Parameters:
+        - voter_credentials: A dictionary where each key is a voter ID and the value is a dictionary
+            of (credential, amount) pairs, or an Electorate, whose credential rows are then reused.
+            Must hold every accepted voter.
+        - credentials: Optional column order for the credentials, if voter_credentials is a dictionary.
+        """
+        if isinstance(voter_credentials, Electorate):
+            if self.voter_ids == voter_credentials.voter_ids:
+                rows = np.arange(voter_credentials.num_voters)
+            else:
+                row = {voter: i for i, voter in enumerate(voter_credentials.voter_ids)}
+                rows = np.array([row[voter] for voter in self.voter_ids], dtype=int)
+            return replace(voter_credentials,
+                           voter_ids=list(self.voter_ids),
+                           credential_matrix=voter_credentials.credential_matrix[rows],
+                           candidates=list(self.candidates),
+                           ballot_matrix=self.ballot_matrix.copy())
+        accepted = {voter: voter_credentials[voter] for voter in self.voter_ids}
+        electorate = Electorate.from_dicts(accepted, {}, credentials=credentials, candidates=self.candidates)
+        electorate.ballot_matrix = self.ballot_matrix.copy()
+        return electorate
+
+
+def validate_ballots(voters: Dict[str, Any],
+                     voter_choices: Dict[str, Any],
+                     candidates: Optional[List[str]] = None,
+                     expected_total: Optional[float] = None,
+                     tolerance: float = DEFAULT_TOLERANCE,
+                     candidate_voters: Optional[Iterable[str]] = None,
+                     electorate: Optional[Electorate] = None) -> ValidatedBallots:
+    """
+    Validates and normalizes a set of ballots.
+
+    Parameters:
+    - voters: The voters dictionary of the mechanism. Only its keys are used.
+    - voter_choices: A dictionary where each key is a voter ID and the value is either the chosen
+        candidate, or a dictionary of (candidate, amount) pairs.
+    - candidates: Optional list of the candidates standing. If given, ballots that give anything to
+        another candidate are rejected. Defaults to every candidate that appears on a ballot.
+    - expected_total: Optional total every ballot should add up to, e.g. 1.0 for
+        PercentageAllocationWeightedPlurality. If None, any positive total is accepted and
+        normalized, as RankAndSlide does.
+    - tolerance: Relative tolerance for expected_total.
+    - candidate_voters: Optional voter IDs of people standing as candidates, whose ballots are
+        rejected. This is GroupHug's original isCandidate rule: candidates are not allowed to vote.
+    - electorate: Optional Electorate already built from voter_choices, with every candidate on the
+        ballots as a column (the default of Electorate.from_dicts). Its ballot matrix is checked
+        instead of reading voter_choices again. Only the ballots of voters that are not in the
+        electorate are read from voter_choices. Amounts that are not numbers make
+        Electorate.from_dicts fail, rather than being rejected as not_a_number.
+
+    Returns:
+    - ValidatedBallots: The normalized ballot matrix of the accepted voters, and the rejections.
+    """
+    if electorate is not None:
+        return _validate_electorate(voters, voter_choices, electorate, candidates,
+                                    expected_total, tolerance, candidate_voters)
+
+    voter_ids = list(voter_choices.keys())
+
+    ballots = [_as_ballot(choice) for choice in voter_choices.values()]
+
+    # Standing candidates get the first columns, then any other candidate that appears on a ballot
+    column_index = {candidate: j for j, candidate in enumerate(candidates)} if candidates is not None else {}
+    cols = np.array([column_index.setdefault(candidate, len(column_index))
+                     for ballot in ballots for candidate in ballot], dtype=int)
+    rows = np.repeat(np.arange(len(ballots)), [len(ballot) for ballot in ballots])
+    amounts = _to_floats([amount for ballot in ballots for amount in ballot.values()])
+    columns = list(column_index)
+    standing = list(candidates) if candidates is not None else columns
+
+    matrix = np.zeros((len(voter_ids), len(columns)))
+    matrix[rows, cols] = amounts
+
+    return _validate_matrix(voters, voter_ids, matrix, standing, expected_total, tolerance, candidate_voters)
+
+
+def _validate_electorate(voters, voter_choices, electorate, candidates,
+                         expected_total, tolerance, candidate_voters):
+    # The rows of the electorate that hold a ballot, with the standing candidates in the first
+    # columns, then the electorate's other candidates. The voter IDs are the only loop left,
+    # through map and compress.
+    has_ballot = np.fromiter(map(voter_choices.__contains__, electorate.voter_ids),
+                             dtype=bool, count=electorate.num_voters)
+    every_voter = bool(has_ballot.all())
+    voter_ids = list(electorate.voter_ids) if every_voter else list(compress(electorate.voter_ids, has_ballot))
+    column_index = {candidate: j for j, candidate in enumerate(electorate.candidates)}
+    standing = list(candidates) if candidates is not None else list(electorate.candidates)
+    placed = set(standing)
+    # -1 picks the column of zeros appended below, for standing candidates nobody voted for
+    sources = [column_index.get(candidate, -1) for candidate in standing] \
+        + [j for j, candidate in enumerate(electorate.candidates) if candidate not in placed]
+    ballots = electorate.ballot_matrix if every_voter else electorate.ballot_matrix[has_ballot]
+    matrix = np.hstack([ballots, np.zeros((len(ballots), 1))])[:, sources]
+
+    validated = _validate_matrix(voters, voter_ids, matrix, standing, expected_total, tolerance, candidate_voters)
+
+    # Ballots the electorate left out are read from voter_choices, to report every reason that applies.
+    # If every voter has a ballot and there are no more ballots than voters, there are none.
+    unknown = voter_choices.keys() - set(voter_ids) if len(voter_choices) > len(voter_ids) else set()
+    if unknown:
+        unknown = {voter: voter_choices[voter] for voter in unknown}
+        report = validate_ballots(voters, unknown, standing, expected_total, tolerance, candidate_voters)
+        for voter in unknown:
+            validated.rejections[voter] = ["unknown_voter"] + [reason for reason in report.rejections.get(voter, [])
+                                                               if reason != "unknown_voter"]
+    return validated
+
+
+def _validate_matrix(voters, voter_ids, matrix, standing, expected_total, tolerance, candidate_voters):
+    # Every check as a mask over the (ballots x candidates) matrix, standing candidates first
+    finite = np.isfinite(matrix)
+    clean = np.where(finite, matrix, 0.0)
+    totals = clean.sum(axis=1)
+
+    excluded = set(candidate_voters or [])
+    checks = {"unknown_voter": ~np.fromiter(map(voters.__contains__, voter_ids), dtype=bool, count=len(voter_ids)),
+              "candidate_voter": np.fromiter(map(excluded.__contains__, voter_ids), dtype=bool, count=len(voter_ids))
+                                 if excluded else np.zeros(len(voter_ids), dtype=bool),
+              "unknown_candidate": (clean[:, len(standing):] != 0).any(axis=1),
+              "not_a_number": ~finite.all(axis=1),
+              "negative": (clean < 0).any(axis=1)}
+    # Totals only mean something for ballots without bad amounts
+    well_formed = ~(checks["not_a_number"] | checks["negative"])
+    checks["empty"] = well_formed & (totals == 0)
+    if expected_total is not None:
+        checks["wrong_total"] = well_formed & (totals != 0) & ~np.isclose(totals, expected_total,
+                                                                           rtol=tolerance, atol=0)
+    else:
+        checks["wrong_total"] = np.zeros(len(voter_ids), dtype=bool)
+
+    failed = np.column_stack([checks[reason] for reason in REJECTION_REASONS]) \
+        if voter_ids else np.zeros((0, len(REJECTION_REASONS)), dtype=bool)
+    rejected = failed.any(axis=1)
+    rejections = {voter_ids[i]: [REJECTION_REASONS[r] for r in np.flatnonzero(failed[i])]
+                  for i in np.flatnonzero(rejected)}
+
+    accepted = ~rejected
+    accepted_totals = totals[accepted]
+    ballot_matrix = clean[accepted][:, :len(standing)] / accepted_totals[:, None]
+
+    return ValidatedBallots(list(compress(voter_ids, accepted)),
+                            standing,
+                            ballot_matrix,
+                            accepted_totals,
+                            rejections)
+
+
+def _to_floats(amounts: List[Any]) -> np.ndarray:
+    # Amounts that are not numbers, such as None or strings, become NaN
+    try:
+        return np.array(amounts, dtype=float)
+    except (TypeError, ValueError):
+        return np.array([_to_float(amount) for amount in amounts], dtype=float)
+
+
+def _to_float(amount: Any) -> float:
+    try:
+        return float(amount)
+    except (TypeError, ValueError):
+        return np.nan
@@ -0,0 +1,208 @@
+"""electorate.py
+
+Implements an array representation of an electorate, so that mechanisms and metrics
+can work over every voter at once instead of looping over nested dictionaries.
+
+The representation has two matrices:
+- credential_matrix: one row per voter, one column per credential (NFT), holding how many
+  of that credential the voter has.
+- ballot_matrix: one row per voter, one column per candidate, holding what the voter gave
+  to that candidate (1.0 for a single choice, a proportion or a point amount otherwise).
+
+The score functions at the bottom of this file are the array versions of the mechanisms in
+this package. They accept an optional leading batch axis, so that many variations of an
+electorate (splits, reweightings, resamples) can be scored in one matrix product.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# Same total as SingleChoiceQuadraticCredibility.allocate_points_from_credentials
+DEFAULT_TOTAL_POINTS = 10_000
+
+# Names of the mechanisms the score functions below cover, as the metrics modules refer to them:
+# - "weighted_plurality": SingleChoiceWeightedPlurality
+# - "percentage_allocation": PercentageAllocationWeightedPlurality
+# - "rank_and_slide": RankAndSlide
+# - "quadratic_credibility": SingleChoiceQuadraticCredibility
+# - "group_hug": GroupHug, or any other GroupMechanism
+# The linear mechanisms all score as weighted_scores.
+LINEAR_MECHANISMS = ["weighted_plurality", "percentage_allocation", "rank_and_slide"]
+MECHANISMS = LINEAR_MECHANISMS + ["quadratic_credibility", "group_hug"]
+# One of every kind of mechanism, as the metrics evaluate by default
+DEFAULT_MECHANISMS = ["weighted_plurality", "rank_and_slide", "quadratic_credibility", "group_hug"]
+
+
+@dataclass
+class Electorate:
+    """
+    Array form of a set of voters, their credentials and their ballots.
+
+    Attributes:
+        voter_ids (List[str]): The voter IDs, in row order.
+        credentials (List[str]): The credential names, in column order of credential_matrix.
+        credential_matrix (np.ndarray): A (voters x credentials) array of credential holdings.
+        candidates (List[str]): The candidate names, in column order of ballot_matrix.
+        ballot_matrix (np.ndarray): A (voters x candidates) array of what each voter gave each candidate.
+    """
+    voter_ids: List[str]
+    credentials: List[str]
+    credential_matrix: np.ndarray
+    candidates: List[str]
+    ballot_matrix: np.ndarray
+
+    @classmethod
+    def from_dicts(cls,
+                   voter_credentials: Dict[str, Dict[str, Any]],
+                   voter_choices: Dict[str, Any],
+                   credentials: Optional[List[str]] = None,
+                   candidates: Optional[List[str]] = None) -> "Electorate":
+        """
+        Builds an electorate from the nested dictionaries used by the mechanisms.
+
+        Parameters:
+        - voter_credentials: A dictionary where each key is a voter ID and the value is a dictionary
+            of (credential, amount) pairs. Booleans and None are read as 1 and 0.
+        - voter_choices: A dictionary where each key is a voter ID and the value is either the chosen
+            candidate, or a dictionary of (candidate, amount) pairs.
+        - credentials: Optional column order for the credentials. Defaults to order of first appearance.
+        - candidates: Optional column order for the candidates. Defaults to order of first appearance.
+
+        Returns:
+        - Electorate: The array representation. Voters without a ballot get an empty ballot row,
+            and ballots of voters that are not in voter_credentials are left out.
+        """
+        voter_ids = list(voter_credentials.keys())
+
+        if credentials is None:
+            credentials = list(dict.fromkeys(credential
+                                             for held in voter_credentials.values()
+                                             for credential in held))
+        if candidates is None:
+            candidates = list(dict.fromkeys(candidate
+                                            for choice in voter_choices.values()
+                                            for candidate in _as_ballot(choice)))
+
+        credential_index = {credential: j for j, credential in enumerate(credentials)}
+        candidate_index = {candidate: j for j, candidate in enumerate(candidates)}
+
+        credential_matrix = np.zeros((len(voter_ids), len(credentials)))
+        ballot_matrix = np.zeros((len(voter_ids), len(candidates)))
+
+        for i, voter in enumerate(voter_ids):
+            for credential, amount in voter_credentials[voter].items():
+                if credential in credential_index and amount:
+                    credential_matrix[i, credential_index[credential]] = float(amount)
+            if voter in voter_choices:
+                for candidate, amount in _as_ballot(voter_choices[voter]).items():
+                    if candidate in candidate_index:
+                        ballot_matrix[i, candidate_index[candidate]] = amount
+
+        return cls(voter_ids, list(credentials), credential_matrix,
+                   list(candidates), ballot_matrix)
+
+    @property
+    def num_voters(self) -> int:
+        return len(self.voter_ids)
+
+    def weight_vector(self, credential_weights: Dict[str, float]) -> np.ndarray:
+        """
+        Returns the credential weights as an array aligned with the credential columns.
+        Credentials missing from credential_weights have weight 0.
+        """
+        return np.array([credential_weights.get(credential, 0) for credential in self.credentials],
+                        dtype=float)
+
+    def voter_weights(self, credential_weights: Dict[str, float]) -> np.ndarray:
+        """
+        Returns the total weight of each voter, i.e. the sum of held credentials times their weight.
+        This is the array version of RankAndSlide.allocate_points_from_credentials.
+        """
+        return self.credential_matrix @ self.weight_vector(credential_weights)
+
+    def holdings(self) -> np.ndarray:
+        """
+        Returns a boolean (voters x credentials) array of which credentials each voter holds,
+        as GroupHug sees them.
+        """
+        return self.credential_matrix > 0
+
+    def proportions(self) -> np.ndarray:
+        """
+        Returns the ballot matrix with each row normalized to sum to 1.
+        Empty ballots stay as rows of 0, rather than dividing by zero.
+        """
+        totals = self.ballot_matrix.sum(axis=1, keepdims=True)
+        return np.divide(self.ballot_matrix, totals,
+                         out=np.zeros_like(self.ballot_matrix), where=totals != 0)
+
+    def to_dict(self, scores: np.ndarray) -> Dict[str, float]:
+        """
+        Converts a vector of candidate scores back to the {candidate: score} form.
+        """
+        return {candidate: float(score) for candidate, score in zip(self.candidates, scores)}
+
+
+def _as_ballot(choice: Any) -> Dict[str, float]:
+    # Single choice ballots are a full allocation to one candidate
+    if isinstance(choice, dict):
+        return choice
+    return {choice: 1.0}
+
+
+##################################
+## Begin score functions.       ##
+##################################
+
+def weighted_scores(voter_weights: np.ndarray,
+                    proportions: np.ndarray) -> np.ndarray:
+    """
+    Scores for the linear mechanisms: SingleChoiceWeightedPlurality,
+    PercentageAllocationWeightedPlurality and RankAndSlide.
+
+    Parameters:
+    - voter_weights: A (voters,) or (batch x voters) array of voter weights or points.
+    - proportions: A (voters x candidates) array of normalized ballots.
+
+    Returns:
+    - np.ndarray: A (candidates,) or (batch x candidates) array of scores.
+    """
+    return voter_weights @ proportions
+
+
+def quadratic_credibility_points(voter_weights: np.ndarray,
+                                 total_amount_to_allocate: float = DEFAULT_TOTAL_POINTS) -> np.ndarray:
+    """
+    Array version of SingleChoiceQuadraticCredibility.allocate_points_from_credentials:
+    scales voter weights so that they sum to total_amount_to_allocate.
+    """
+    totals = voter_weights.sum(axis=-1, keepdims=True)
+    return total_amount_to_allocate * np.divide(voter_weights, totals,
+                                                out=np.zeros_like(voter_weights, dtype=float),
+                                                where=totals != 0)
+
+
+def quadratic_credibility_scores(allocations: np.ndarray,
+                                 multiplicity: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Scores for SingleChoiceQuadraticCredibility: square root each allocation,
+    add them up per candidate, then square.
+
+    Parameters:
+    - allocations: A (voters x candidates) array of points given to each candidate.
+    - multiplicity: Optional (voters,) or (batch x voters) array. A voter with multiplicity m
+        counts as m addresses that each gave 1/m of the voter's allocation, which contributes
+        sqrt(m * allocation) instead of sqrt(allocation).
+
+    Returns:
+    - np.ndarray: A (candidates,) or (batch x candidates) array of scores.
+    """
+    if multiplicity is None:
+        return np.square(np.sqrt(allocations).sum(axis=0))
+    return np.square(np.sqrt(multiplicity) @ np.sqrt(allocations))
+
+##################################
+## End score functions.         ##
+##################################
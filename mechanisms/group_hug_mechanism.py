@@ -2,11 +2,13 @@
 
 Implements a group based calculation method, where each stakeholder group has 
 a weight and rules by which points are distributed. 
+
+GroupHug is a preset of the general GroupMechanism, with four groups: experts,
+intellectuals, participants and community.
 """
-from typing import Any, Dict, List
+from typing import Dict, List
 
-from custom_types import Voter
-from mechanisms.voting_mechanism import VotingMechanism
+from mechanisms.group_mechanism import GroupMechanism, StakeholderGroup
 
 #Set default amounts for each NFT to contribute to individual 
 DEFAULT_NFT_WEIGHTS = {
@@ -72,7 +74,7 @@ DEFAULT_PARTICIPANTS_NFT_LIST = [
 
 DEFAULT_COMMUNITY_NFT_LIST = [ ]
 
-class GroupHug(VotingMechanism):
+class GroupHug(GroupMechanism):
     """
     A voting system class that implements a stakeholder group based voting mechanism.
 
@@ -81,6 +83,13 @@ class GroupHug(VotingMechanism):
             is a dictionary of (NFT ID, boolean) pairs.
         voter_choices (Dict[str, str]): A dictionary where each key is a voter ID and the value is
             the candidate chosen by that voter.
+
+    Basic Idea of GroupHug:
+    Step 0. Based on NFT criteria, voters are given multiple labels corresponding to different groups.
+    Step 1. For each group, the criteria are scored corresponding to a mechanism.
+    Step 2. The group results are combined, according to weight for each group.
+    Step 3. The winner is determined by combining group results. Ties are broken by
+            the experts, then by the community.
     """
 
     def __init__(self, 
@@ -94,9 +103,6 @@ class GroupHug(VotingMechanism):
                  participants_nft_list: List[str] = DEFAULT_PARTICIPANTS_NFT_LIST,
                  community_nft_list: List[str] = DEFAULT_COMMUNITY_NFT_LIST):
 
-        # Set the default NFT weights for each NFT
-        self.nft_weights = nft_weights
-
         # Set the group weights to constructor inputs, or default values if not set 
         self.experts_group_weight = experts_group_weight
         self.intellectuals_group_weight = intellectuals_group_weight
@@ -109,220 +115,26 @@ class GroupHug(VotingMechanism):
         self.participants_nft_list = participants_nft_list 
         self.community_nft_list = community_nft_list 
 
-    def calculate(self, voters: Dict[str, Dict[str, Any]], 
-                  voter_choices: Dict[str, str]):
-        """
-        Implements the group hug voting mechanism.
-
-        Parameters:
-        - voters: A dictionary where each key is a voter ID and the value is a dictionary 
-            of (NFT, boolean) pairs to signify if the voter holds this NFT. 
-        - voter_choices: A dictionary where each key is a voter ID and the value is the chosen candidate.
-
-        Returns:
-        - str: The winning candidate.
-        - dict: The result of each candidate.
-
-        Basic Idea of GroupHug:
-        Step 0. Based on NFT criteria, voters are given multiple labels corresponding to different groups.
-        Step 1. For each group, the criteria are scored corresponding to a mechanism.
-        Step 2. The group results are combined, according to weight for each group.
-        Step 3. The winner is determined by combining group results. 
-        """
-
-        # Extract and convert input to internal format
-        extracted_candidates = set(voter_choices.values())
-        extracted_voters = []
-        for v in voters:
-            choice = voter_choices[v]
-            nfts = [nft for nft in voters[v] if voters[v][nft]]
-            extracted_voters.append(Voter(choice, nfts))
-        
-        # Analyze election results
-        (aggregate_vote, e, i, p, c) = self.vote(extracted_candidates, extracted_voters, verbose = True)
-        winner = self.declare_winner(aggregate_vote, e, c)
-
-        return (winner, aggregate_vote)
-
-    
-    ##################################
-    ## Begin expert section.        ##
-    ##################################
-
-    def is_expert(self, voter):
-        for nft in voter.nfts:
-            if nft in self.experts_nft_list:
-                return True
-
-    # The experts are highly qualified peers.
-    # They are fellowship committee members, TE Fundamentals course authors, 
-    # or TE Study Season / ETHCC / Barcamp speakers.
-    # They follow a principle of one person, one vote.
-
-    def ask_the_experts(self, candidates, voters):
-
-        experts = set([voter for voter in voters if self.is_expert(voter)])
-                    
-        return self.ask_the_community(candidates, experts)
-
-    ##################################
-    ## End expert section.          ##
-    ##################################
-
-    ####################################
-    ## Begin intellectual section.    ##
-    ####################################
-
-    def weight_intellectual(self, voter):
-            w = 0             
-            for nft in voter.nfts:
-                if nft in self.intellectuals_nft_list:
-                    w += self.nft_weights[nft]
-
-            return w
-
-    # The intellectuals are students who hold one or more NFTs as proof-of-knowledge,
-    # either from TE Fundamentals, the NFT-based reputation course, or Barcamp.
-    # The weights for each NFT are set in the `nft_weights` dictionary. 
-
-    def ask_the_intellectuals(self, candidates, voters):
-        
-        cpoints = {c: 0 for c in candidates}
-
-        for voter in voters:
-            cpoints[voter.vote] += self.weight_intellectual(voter)
-
-        return cpoints
-
-    ####################################
-    ## End intellectual section.      ##
-    ####################################
-
-    
-    ###########################################
-    ## Begin active participants section.    ##
-    ###########################################
-
-    def weight_active_participant(self, voter):
-
-        w = 0
-        for nft in voter.nfts:
-            if nft in self.participants_nft_list:
-                w += self.nft_weights.get(nft, 0)
-
-        return w
-
-    
-    def ask_the_active_participants(self, candidates, voters):
-
-        cpoints = {c: 0 for c in candidates}
-
-        for voter in voters:
-            cpoints[voter.vote] += self.weight_active_participant(voter)
-
-        return cpoints
-
-    ###########################################
-    ## End active participants section.     ##
-    ###########################################
-
-   ###########################################
-   ## Begin community  section.             ##
-   ###########################################
-
-    # The community is a large and very diverse group of people.
-    # All voters are treated equally: One person > one vote. No weights are applied.
-    # NOTE: This is also called for other groups, after they have been weighted. 
-    def ask_the_community(self, candidates, voters):
-
-        votecount = {}
-        for c in candidates:
-            votecount[c] = len([voter for voter in voters if voter.vote == c])
-        
-        return votecount
-    
-   ###########################################
-   ## End community  section.               ##
-   ###########################################
-
-   ############################################
-   ## Begin vote-counting mechanics session. ##
-   ############################################
-
-    #  Helper function to convert a set of points into percentages to allow aggregation across several sets of points.
-    def normalize(self, points):
-
-        total = sum(points.values())
-
-        if total == 0: return {c: 0 for c in points}
-        else: return {c: round(100 * points[c] / total, 1) for c in points}
-    
-    # Helper function to convert a dicitionary to a more readable form. 
-    def str_dict(self, d):
-        return str(dict(sorted(d.items())))
-
-
-    # Main vote-counting mechanics
-    def vote(self, candidates, voters, verbose = False):
-        eligible = [v for v in voters if not v.isCandidate]   # Candidates are not allowed to vote!
-
-        experts = self.normalize(self.ask_the_experts(candidates, eligible))
-        intellectuals = self.normalize(self.ask_the_intellectuals(candidates, eligible))
-        participants = self.normalize(self.ask_the_active_participants(candidates, eligible))
-        community = self.normalize(self.ask_the_community(candidates, eligible))
-        
-        if verbose:
-            print("\nExperts: " + self.str_dict(experts))
-            print("Intellectuals: " + self.str_dict(intellectuals))
-            print("Participants: " + self.str_dict(participants))
-            print("Community: " + self.str_dict(community))
-
-        aggregate = {c: 0 for c in candidates}
-
-        for c in experts:
-            aggregate[c] += (experts[c]*self.experts_group_weight)
-
-        for c in intellectuals:
-            aggregate[c] += (intellectuals[c]*self.intellectuals_group_weight)
-
-        for c in participants:
-            aggregate[c] += (participants[c]*self.participants_group_weight)
-
-        for c in community:
-            aggregate[c] += (community[c]*self.community_group_weight)
-
-        result = self.normalize(aggregate)
-
-        return (result, experts, intellectuals, participants, community)
-
-
-    def declare_winner(self, aggregate_vote, experts_vote, community_vote):
-
-        m = max(aggregate_vote.values())
-        winners = [k for k in aggregate_vote if aggregate_vote[k] == m]
-
-        if len(winners) == 1:       # There is a unique winner
-            return winners[0]
-        
-        print("Tie. We'll ask the experts to resolve it.")
-        e_filtered = {k: v for k,v in experts_vote.items() if k in winners}
-        m_e = max(e_filtered.values())
-        winners_e = [k for k in e_filtered if e_filtered[k] == m_e]
-
-        if len(winners_e) == 1:     # The experts prefer one winner over the other(s)
-            return winners_e[0]
-
-        print("Experts could not resolve tie. We'll ask the community.")
-        c_filtered = {k: v for k,v in community_vote.items() if k in winners}
-        m_c = max(c_filtered.values())
-        winners_c = [k for k in c_filtered if c_filtered[k] == m_c]
-
-        if len(winners_c) == 1:     # The community prefers one winner over the other(s)
-            return winners_c[0]
-        
-        raise Exception("A unique winner could not be found!")
-
-   ############################################
-   ## End vote-counting mechanics session.   ##
-   ############################################
-
+        groups = [
+            # The experts are highly qualified peers.
+            # They are fellowship committee members, TE Fundamentals course authors, 
+            # or TE Study Season / ETHCC / Barcamp speakers.
+            # They follow a principle of one person, one vote.
+            StakeholderGroup("experts", "any_of", experts_nft_list, experts_group_weight),
+
+            # The intellectuals are students who hold one or more NFTs as proof-of-knowledge,
+            # either from TE Fundamentals, the NFT-based reputation course, or Barcamp.
+            # The weights for each NFT are set in the `nft_weights` dictionary. 
+            StakeholderGroup("intellectuals", "weighted_sum", intellectuals_nft_list, intellectuals_group_weight),
+
+            # The active participants hold proof-of-participation NFTs, weighted the same way.
+            StakeholderGroup("participants", "weighted_sum", participants_nft_list, participants_group_weight),
+
+            # The community is a large and very diverse group of people.
+            # All voters are treated equally: One person > one vote. No weights are applied.
+            StakeholderGroup("community", "one_person_one_vote", community_nft_list, community_group_weight),
+        ]
+
+        super().__init__(groups, nft_weights,
+                         tie_break_order = ["experts", "community"],
+                         verbose = True)
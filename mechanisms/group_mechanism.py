@@ -0,0 +1,317 @@
+"""group_mechanism.py
+
+Implements a general stakeholder group mechanism, where voters belong to any number of groups,
+each group tallies the vote by its own membership rule, and the group results are combined
+according to a weight for each group. GroupHug is one preset of this mechanism.
+
+All groups are evaluated together: the credential matrix times a (credentials x groups) membership
+matrix gives every voter's weight in every group, and one more product with the ballots gives
+every group's tally. Adding groups adds columns, not passes over the voters.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Literal, Optional
+
+import numpy as np
+
+from mechanisms.electorate import Electorate
+from mechanisms.ranking import UnresolvedTieError
+from mechanisms.voting_mechanism import VotingMechanism
+
+# How a group turns credentials into voting weight:
+# - "any_of": one person, one vote, for every voter holding at least one of the group's credentials.
+# - "weighted_sum": the sum of the weights of the group's credentials that the voter holds.
+# - "one_person_one_vote": one person, one vote, for every voter. The credentials are not used.
+MembershipRule = Literal["any_of", "weighted_sum", "one_person_one_vote"]
+
+HEAD_COUNT_RULES = ["any_of", "one_person_one_vote"]
+
+
+@dataclass
+class StakeholderGroup:
+    """
+    A stakeholder group and the rule by which its members vote.
+
+    Attributes:
+        name (str): The name of the group.
+        rule (MembershipRule): The membership rule, see MembershipRule.
+        credentials (List[str]): The credentials (NFTs) that qualify a voter for the group.
+        weight (float): The weight of the group's result in the combined result.
+    """
+    name: str
+    rule: MembershipRule
+    credentials: List[str] = field(default_factory=list)
+    weight: float = 1
+
+
+def round_percentages(shares: np.ndarray) -> np.ndarray:
+    """
+    Rounds to one decimal like Python's round(x, 1), which GroupHug used on each percentage.
+    numpy rounds x * 10 instead, which differs from Python where x * 10 lands on a half,
+    so those few values are rounded by Python.
+    """
+    scaled = shares * 10
+    result = np.round(scaled) / 10
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_half.any():
+        result[near_half] = [round(x, 1) for x in shares[near_half].tolist()]
+    return result
+
+
+class GroupMechanism(VotingMechanism):
+    """
+    A voting system class that implements a general stakeholder group based voting mechanism.
+
+    Attributes:
+        groups (List[StakeholderGroup]): The stakeholder groups.
+        nft_weights (Dict[str, float]): The weight of each NFT, for "weighted_sum" groups.
+        tie_break_order (List[str]): The names of the groups asked, in order, to break a tie.
+        verbose (bool): Whether to print the result of each group.
+    """
+
+    def __init__(self,
+                 groups: List[StakeholderGroup],
+                 nft_weights: Dict[str, float],
+                 tie_break_order: Optional[List[str]] = None,
+                 verbose: bool = False):
+        self.groups = groups
+        self.nft_weights = nft_weights
+        self.tie_break_order = tie_break_order if tie_break_order is not None else []
+        self.verbose = verbose
+
+        for name in self.tie_break_order:
+            if name not in self.group_names():
+                raise ValueError(f"Unknown group in tie break order: {name}")
+
+    @classmethod
+    def from_categories(cls,
+                        categories: Dict[str, str],
+                        nft_weights: Dict[str, float],
+                        rules: Optional[Dict[str, MembershipRule]] = None,
+                        group_weights: Optional[Dict[str, float]] = None,
+                        tie_break_order: Optional[List[str]] = None,
+                        community_group: bool = True,
+                        verbose: bool = False) -> "GroupMechanism":
+        """
+        Builds one group per credential category, e.g. the Category column of votingWeightsComm.csv.
+
+        Parameters:
+        - categories: A dictionary of (credential, category) pairs.
+        - nft_weights: The weight of each credential.
+        - rules: Optional membership rule per category. Defaults to "weighted_sum".
+        - group_weights: Optional weight per category. Defaults to 1.
+        - tie_break_order: Optional names of the groups asked, in order, to break a tie.
+        - community_group: If True, adds a "community" group where every voter has one vote.
+        - verbose: Whether to print the result of each group.
+        """
+        rules = rules or {}
+        group_weights = group_weights or {}
+
+        groups = []
+        for category in dict.fromkeys(categories.values()):
+            credentials = [credential for credential, c in categories.items() if c == category]
+            groups.append(StakeholderGroup(category,
+                                           rules.get(category, "weighted_sum"),
+                                           credentials,
+                                           group_weights.get(category, 1)))
+        if community_group:
+            groups.append(StakeholderGroup("community", "one_person_one_vote", [],
+                                           group_weights.get("community", 1)))
+
+        return cls(groups, nft_weights, tie_break_order, verbose)
+
+    def group_names(self) -> List[str]:
+        return [group.name for group in self.groups]
+
+    def group_weight_vector(self) -> np.ndarray:
+        return np.array([group.weight for group in self.groups], dtype=float)
+
+    def calculate(self, voters: Dict[str, Dict[str, Any]],
+                  voter_choices: Dict[str, str]):
+        """
+        Implements the stakeholder group voting mechanism.
+
+        Parameters:
+        - voters: A dictionary where each key is a voter ID and the value is a dictionary
+            of (NFT, boolean) pairs to signify if the voter holds this NFT.
+        - voter_choices: A dictionary where each key is a voter ID and the value is the chosen candidate.
+
+        Returns:
+        - str: The winning candidate.
+        - dict: The result of each candidate.
+
+        Step 0. Based on NFT criteria, voters get a weight in each group (0 if they are not a member).
+        Step 1. Each group tallies the vote, and turns its tally into percentages.
+        Step 2. The group results are combined, according to weight for each group.
+        Step 3. The winner is determined by combining group results, with ties broken by the groups
+                in tie_break_order.
+        """
+        aggregate_vote, group_votes = self.candidate_scores(voters, voter_choices)
+
+        if self.verbose:
+            print()
+            for name, group_vote in group_votes.items():
+                print(name.capitalize() + ": " + str(dict(sorted(group_vote.items()))))
+
+        winner = self.declare_winner(aggregate_vote, group_votes)
+
+        return (winner, aggregate_vote)
+
+    def candidate_scores(self, voters: Dict[str, Dict[str, Any]],
+                         voter_choices: Dict[str, str]):
+        """
+        Returns the combined result of each candidate, and the result of each group by group name.
+        The group results are what tie-break policies such as tie_break_order refer to.
+        """
+        # Candidates in the same order as the set GroupHug always used, so that percentages
+        # are added up in the same order
+        candidates = list(set(voter_choices.values()))
+        electorate = Electorate.from_dicts(voters, voter_choices, candidates=candidates)
+        aggregate, shares = self.vote_arrays(electorate)
+
+        aggregate_vote = self.to_percentages(electorate, aggregate)
+        group_votes = {group.name: self.to_percentages(electorate, group_shares)
+                       for group, group_shares in zip(self.groups, shares)}
+        return aggregate_vote, group_votes
+
+    def default_tie_break(self):
+        # The groups declare_winner asks, e.g. experts then community for GroupHug
+        return list(self.tie_break_order)
+
+    def cascade_tie_break(self):
+        # As in declare_winner, every group looks at all tied candidates
+        return True
+
+    ############################################
+    ## Begin vote-counting mechanics section. ##
+    ############################################
+
+    # Converts points into percentages along the last axis, to allow aggregation across groups.
+    # Leaving out the rounding gives shares that change smoothly with the inputs.
+    def normalize_arrays(self, points, rounded = True):
+
+        total = points.sum(axis=-1, keepdims=True)
+        shares = np.divide(100 * points, total, out=np.zeros_like(points, dtype=float), where=total != 0)
+        return round_percentages(shares) if rounded else shares
+
+    # Converts an array of percentages to a {candidate: percentage} dictionary.
+    # A group where nobody voted has 0 for every candidate.
+    def to_percentages(self, electorate: Electorate, shares):
+
+        if not shares.any():
+            return {c: 0 for c in electorate.candidates}
+        return electorate.to_dict(shares)
+
+    # Weight of every voter within each group, as a (voters x groups) array.
+    # `multiplicities` optionally maps group names to a per-voter multiplicity: in a head count
+    # group, a voter with multiplicity m is counted as m voters, which lets callers score split
+    # or duplicated voters without copying them. `nft_weights` optionally replaces
+    # `self.nft_weights` with an array aligned with the electorate's credentials.
+    # Multiplicities and `nft_weights` can carry a leading batch axis.
+    def group_member_weights(self, electorate: Electorate,
+                             multiplicities: Optional[Dict[str, np.ndarray]] = None,
+                             nft_weights: Optional[np.ndarray] = None):
+
+        held = electorate.holdings().astype(float)
+        if nft_weights is None:
+            nft_weights = electorate.weight_vector(self.nft_weights)
+        multiplicities = multiplicities or {}
+
+        # (credentials x groups) matrix of which credentials count towards each group
+        membership = np.array([[credential in group.credentials for group in self.groups]
+                               for credential in electorate.credentials], dtype=float).reshape(-1, len(self.groups))
+        weighted = np.array([group.rule == "weighted_sum" for group in self.groups])
+        membership = np.where(weighted, membership * np.asarray(nft_weights)[..., :, None], membership)
+
+        members = held @ membership
+        for g, group in enumerate(self.groups):
+            if group.rule == "any_of":
+                members[..., g] = members[..., g] > 0
+            elif group.rule == "one_person_one_vote":
+                members[..., g] = 1
+
+        head_counts = [g for g, group in enumerate(self.groups)
+                       if group.rule in HEAD_COUNT_RULES and group.name in multiplicities]
+        if head_counts:
+            scale = [multiplicities[self.groups[g].name] for g in head_counts]
+            batch_shape = np.broadcast_shapes(members.shape[:-1], *[np.shape(m) for m in scale])
+            members = np.broadcast_to(members, batch_shape + members.shape[-1:]).copy()
+            for g, multiplicity in zip(head_counts, scale):
+                members[..., g] = members[..., g] * multiplicity
+
+        return members
+
+    # Array version of the whole vote, over every voter of an electorate at once.
+    # Returns the combined result per candidate, and a (groups x candidates) array of each group's result.
+    def vote_arrays(self, electorate: Electorate,
+                    multiplicities: Optional[Dict[str, np.ndarray]] = None,
+                    nft_weights: Optional[np.ndarray] = None,
+                    rounded: bool = True):
+
+        members = self.group_member_weights(electorate, multiplicities, nft_weights)
+        tallies = np.swapaxes(members, -1, -2) @ electorate.proportions()
+
+        return self.combine_tallies(tallies, rounded)
+
+    # Turns a (groups x candidates) array of group tallies into the combined result per candidate,
+    # and each group's result. Tallies can carry a leading batch axis.
+    def combine_tallies(self, tallies, rounded = True):
+
+        shares = self.normalize_arrays(tallies, rounded)
+
+        # Add the groups one at a time, so each candidate's total is summed in group order
+        aggregate = np.zeros(shares.shape[:-2] + shares.shape[-1:])
+        for g, group in enumerate(self.groups):
+            aggregate = aggregate + shares[..., g, :] * group.weight
+
+        result = self.normalize_arrays(aggregate, rounded)
+
+        return (result, shares)
+
+    def declare_winner(self, aggregate_vote: Dict[str, float],
+                       group_votes: Dict[str, Dict[str, float]]):
+
+        m = max(aggregate_vote.values())
+        winners = [k for k in aggregate_vote if aggregate_vote[k] == m]
+
+        if len(winners) == 1:       # There is a unique winner
+            return winners[0]
+
+        previous = None
+        for name in self.tie_break_order:
+            if previous is None:
+                print(f"Tie. We'll ask the {name} to resolve it.")
+            else:
+                print(f"{previous.capitalize()} could not resolve tie. We'll ask the {name}.")
+
+            # Every group looks at all candidates that tied on the combined result
+            filtered = {k: v for k, v in group_votes[name].items() if k in winners}
+            m_g = max(filtered.values())
+            winners_g = [k for k in filtered if filtered[k] == m_g]
+
+            if len(winners_g) == 1:     # The group prefers one winner over the other(s)
+                return winners_g[0]
+            previous = name
+
+        raise UnresolvedTieError("A unique winner could not be found!")
+
+    # Array version of declare_winner, for a batch of results from combine_tallies.
+    # Returns the winning column of each row, or -1 where the tie could not be resolved.
+    def declare_winners(self, result, shares):
+
+        winners = result == result.max(axis=-1, keepdims=True)
+        winner = np.where(winners.sum(axis=-1) == 1, np.argmax(winners, axis=-1), -1)
+
+        names = self.group_names()
+        for name in self.tie_break_order:
+            # Every group looks at all candidates that tied on the combined result
+            filtered = np.where(winners, shares[..., names.index(name), :], -np.inf)
+            winners_g = filtered == filtered.max(axis=-1, keepdims=True)
+            resolved = (winner == -1) & (winners_g.sum(axis=-1) == 1)
+            winner = np.where(resolved, np.argmax(winners_g, axis=-1), winner)
+
+        return winner
+
+    ############################################
+    ## End vote-counting mechanics section.   ##
+    ############################################
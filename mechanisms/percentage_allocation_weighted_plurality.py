@@ -35,6 +35,7 @@ class PercentageAllocationWeightedPlurality(VotingMechanism):
         # Calculate the weighted vote for each candidate based on voter choices and voter weights
         for voter_id, ballot in voter_choices.items():
             # In the interest of speed, we leave out verification that weights sum to 1.0
+            # Use mechanisms.ballot_validation.validate_ballots(..., expected_total=1.0) to check all ballots at once
             # "ballot_total = sum(ballot.values())
             # if not isclose(ballot_total, 1.0, rel_tol = 1e-5):
             #     raise ValueError("The voter's ballot should sum to 1.0")
@@ -91,7 +91,8 @@ class RankAndSlide(VotingMechanism):
             a candidate and a proportion of how much of the voter's score to assign to that candidate
 
         Returns:
-        - SortedDict[str, float]: A sorted dictionary with the candidates along with their score, sorted by highest score.
+        - str: The candidate with the highest score.
+        - dict: The score of each candidate.
         """
         # Initialize a dictionary to keep track of the total weighted votes for each candidate
         candidate_scores = {}
@@ -105,8 +106,7 @@ class RankAndSlide(VotingMechanism):
                 else:
                     candidate_scores[candidate] = proportion *  voters.get(voter_id).get("points",0)
         
-        # Sort candidates by their score, and return the winner (along with the detailed scores)
-        sorted_candidates = dict(sorted(candidate_scores.items(), key=lambda x: x[1], reverse=True))
+        # Return the winner (along with the detailed scores). Use rank() for candidates in score order.
         winner = max(candidate_scores, key=candidate_scores.get)
 
         return winner, candidate_scores
@@ -0,0 +1,284 @@
+"""ranking.py
+
+Implements ranked and multi-winner results on top of any mechanism's candidate scores,
+without sorting the whole candidate set.
+
+- top_k selects the k best candidates with np.argpartition, and only sorts those k.
+- fill_budget funds candidates in score order until a budget runs out. It heapifies the candidates
+  once and pops them one at a time, so only the candidates that are looked at get ordered.
+- batch_winners picks the best candidate of many score rows at once, for resampled elections.
+
+Ties are broken by a tie-break policy: a list of secondary scores, higher is better. By default the
+stages are compared in order, as a sort would. With cascade=True they are applied as
+GroupMechanism.declare_winner does: every stage looks at all candidates still tied, and picks the next
+candidate only if it has a unique best. GroupHug's cascade (ask the experts, then the community) is the
+policy ["experts", "community"] over its group results, with cascade=True. Candidates still tied after
+the policy are ordered by name, so results never depend on dictionary or set order.
+"""
+
+import heapq
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+# A tie-break stage: the name of a secondary score provided by the mechanism
+# (e.g. a GroupHug group), or a {candidate: score} dictionary
+TieBreakStage = Union[str, Dict[str, float]]
+
+
+class UnresolvedTieError(Exception):
+    """Raised when the best candidates are tied and no tie-break stage of a cascade separates them."""
+
+
+@dataclass
+class RankedResult:
+    """
+    The top candidates of an election, best first.
+
+    Attributes:
+        candidates (List[str]): The top candidates, in rank order.
+        scores (List[float]): The score of each of those candidates.
+        tie_broken (List[bool]): Whether each candidate has the same score as the one ranked after it,
+            so that their order comes from the tie-break policy.
+        num_candidates (int): The number of candidates in the election.
+    """
+    candidates: List[str]
+    scores: List[float]
+    tie_broken: List[bool]
+    num_candidates: int
+
+    def winner(self) -> Optional[str]:
+        return self.candidates[0] if self.candidates else None
+
+
+@dataclass
+class BudgetAllocation:
+    """
+    The candidates funded by filling a budget in score order.
+
+    Attributes:
+        funded (List[str]): The funded candidates, in the order they were funded.
+        costs (List[float]): The cost of each funded candidate.
+        scores (List[float]): The score of each funded candidate.
+        budget (float): The budget.
+        spent (float): The total cost of the funded candidates.
+        cutoff (Optional[str]): The best candidate that was not funded because it did not fit the
+            remaining budget, i.e. where the funding line falls. None if nothing was cut off.
+    """
+    funded: List[str]
+    costs: List[float]
+    scores: List[float]
+    budget: float
+    spent: float
+    cutoff: Optional[str]
+
+    @property
+    def remaining(self) -> float:
+        return self.budget - self.spent
+
+
+def tie_break_keys(candidates: Sequence[str],
+                   policy: Sequence[TieBreakStage],
+                   tie_scores: Optional[Dict[str, Dict[str, float]]] = None) -> List[np.ndarray]:
+    """
+    Turns a tie-break policy into arrays aligned with the candidates.
+
+    Parameters:
+    - candidates: The candidates.
+    - policy: The tie-break stages, in order.
+    - tie_scores: The secondary scores the mechanism provides, by name.
+
+    Returns:
+    - List[np.ndarray]: One array per stage. Candidates missing from a stage rank last in it.
+    """
+    tie_scores = tie_scores or {}
+    keys = []
+    for stage in policy:
+        if isinstance(stage, str):
+            if stage not in tie_scores:
+                raise ValueError(f"Unknown tie break stage: {stage}")
+            stage = tie_scores[stage]
+        keys.append(np.array([stage.get(candidate, -np.inf) for candidate in candidates], dtype=float))
+    return keys
+
+
+def top_k(scores: np.ndarray,
+          k: Optional[int] = None,
+          tie_keys: Sequence[np.ndarray] = (),
+          names: Optional[Sequence[str]] = None,
+          cascade: bool = False) -> np.ndarray:
+    """
+    Returns the indices of the k highest scores, best first.
+
+    Only candidates with at least the k-th highest score are sorted. Where candidates with the
+    k-th highest score do not all fit, the tie-break keys decide which ones are kept.
+
+    Parameters:
+    - scores: The score of each candidate.
+    - k: The number of candidates to return. Defaults to all of them.
+    - tie_keys: Secondary scores, used when scores are equal. Higher is better.
+    - names: Optional candidate names, the last tie-break. Defaults to the candidate's position.
+    - cascade: If True, the tie keys are a cascade, see the module docstring. Raises an
+        UnresolvedTieError if the best candidates are tied and no key separates them,
+        as declare_winner does.
+    """
+    scores = np.asarray(scores, dtype=float)
+    n = len(scores)
+    k = n if k is None else max(0, min(k, n))
+    if k == 0:
+        return np.zeros(0, dtype=int)
+
+    if cascade:
+        best = np.flatnonzero(scores == scores.max())
+        if len(best) > 1 and _cascade_pick(best, tie_keys) is None:
+            raise UnresolvedTieError("A unique winner could not be found!")
+
+    if k == n:
+        selected = np.arange(n)
+        return selected[_order(selected, scores, tie_keys, names, cascade)]
+
+    # Candidates above the k-th score all fit. Candidates with the k-th score are ordered as a whole,
+    # as a cascade over part of them could order them differently.
+    threshold = np.partition(scores, n - k)[n - k]
+    above = np.flatnonzero(scores > threshold)
+    boundary = np.flatnonzero(scores == threshold)
+    return np.concatenate([above[_order(above, scores, tie_keys, names, cascade)],
+                           boundary[_order(boundary, scores, tie_keys, names, cascade)][:k - len(above)]])
+
+
+def batch_winners(scores: np.ndarray, names: Sequence[str]) -> np.ndarray:
+    """
+    Returns the index of the highest score in each row of a (batch x candidates) array.
+    Ties are broken by candidate name, as top_k does without tie keys.
+    """
+    name_ranks = np.argsort(np.argsort(np.array(names, dtype=str), kind="stable"), kind="stable")
+    tied = scores == scores.max(axis=-1, keepdims=True)
+    return np.argmin(np.where(tied, name_ranks, len(names)), axis=-1)
+
+
+def rank_scores(scores: Dict[str, float],
+                k: Optional[int] = None,
+                policy: Sequence[TieBreakStage] = (),
+                tie_scores: Optional[Dict[str, Dict[str, float]]] = None,
+                cascade: bool = False) -> RankedResult:
+    """
+    Ranks a {candidate: score} dictionary, as returned by the mechanisms' calculate methods.
+    See top_k and tie_break_keys.
+    """
+    candidates = list(scores)
+    values = np.array([scores[candidate] for candidate in candidates], dtype=float)
+    keys = tie_break_keys(candidates, policy, tie_scores)
+    k = len(candidates) if k is None else max(0, min(k, len(candidates)))
+
+    # One more than asked for, to see whether the last one returned is tied with the next
+    extended = top_k(values, k + 1, keys, candidates, cascade)
+    extended_scores = values[extended]
+    tie_broken = np.zeros(k, dtype=bool)
+    tie_broken[:len(extended) - 1] = extended_scores[:-1] == extended_scores[1:]
+
+    return RankedResult([candidates[i] for i in extended[:k]],
+                        extended_scores[:k].tolist(),
+                        tie_broken.tolist(),
+                        len(candidates))
+
+
+def fill_budget(scores: Dict[str, float],
+                costs: Dict[str, float],
+                budget: float,
+                policy: Sequence[TieBreakStage] = (),
+                tie_scores: Optional[Dict[str, Dict[str, float]]] = None,
+                skip_unaffordable: bool = True,
+                cascade: bool = False) -> BudgetAllocation:
+    """
+    Funds candidates in score order until the budget runs out.
+
+    Parameters:
+    - scores: The score of each candidate.
+    - costs: The cost of each candidate. Candidates without a cost are not funded.
+    - budget: The total budget.
+    - policy: The tie-break policy, see tie_break_keys.
+    - tie_scores: The secondary scores the mechanism provides, by name.
+    - skip_unaffordable: If True, a candidate that does not fit is passed over and cheaper candidates
+        further down can still be funded. If False, funding stops at the first candidate that does not fit.
+    - cascade: If True, the policy is a cascade, see top_k.
+
+    Returns:
+    - BudgetAllocation: The funded candidates and the cut-off.
+    """
+    candidates = [candidate for candidate in scores if candidate in costs]
+    values = np.array([scores[candidate] for candidate in candidates], dtype=float)
+    keys = tie_break_keys(candidates, policy, tie_scores)
+    if cascade and candidates:
+        # Only checks the best candidates, as declare_winner does
+        top_k(values, 1, keys, candidates, cascade)
+
+    # Heap entries sort by score. Candidates with equal scores are popped together
+    # and ordered by the tie-break policy.
+    heap = [(-value, i) for i, value in enumerate(values)]
+    heapq.heapify(heap)
+    cheapest = min((costs[candidate] for candidate in candidates), default=0.0)
+
+    allocation = BudgetAllocation([], [], [], budget, 0.0, None)
+    tied = []
+    while (tied or heap) and allocation.remaining >= cheapest:
+        if not tied:
+            block = [heapq.heappop(heap)[1]]
+            while heap and heap[0][0] == -values[block[0]]:
+                block.append(heapq.heappop(heap)[1])
+            block = np.array(block)
+            tied = block[_order(block, values, keys, candidates, cascade)].tolist()
+        candidate = candidates[tied.pop(0)]
+        cost = costs[candidate]
+        if cost <= allocation.remaining:
+            allocation.funded.append(candidate)
+            allocation.costs.append(cost)
+            allocation.scores.append(scores[candidate])
+            allocation.spent += cost
+            continue
+        if allocation.cutoff is None:
+            allocation.cutoff = candidate
+        if not skip_unaffordable:
+            break
+
+    return allocation
+
+
+def _order(indices, scores, tie_keys, names, cascade=False):
+    # Positions that sort indices best first. np.lexsort sorts by its last key first.
+    keys = [indices]
+    if names is not None:
+        keys.append(np.array([names[i] for i in indices], dtype=str))
+    if not cascade:
+        for key in reversed(list(tie_keys)):
+            keys.append(-key[indices])
+    keys.append(-scores[indices])
+    order = np.lexsort(keys)
+    if not cascade or len(order) < 2:
+        return order
+
+    # Within each run of equal scores, the cascade picks candidates one at a time.
+    # Those it cannot separate keep their order by name.
+    ordered_scores = scores[indices[order]]
+    starts = np.flatnonzero(np.r_[True, ordered_scores[1:] != ordered_scores[:-1]])
+    result = []
+    for run in np.split(order, starts[1:]):
+        run = run.tolist()
+        while len(run) > 1:
+            pick = _cascade_pick(indices[run], tie_keys)
+            if pick is None:
+                break
+            result.append(run.pop(pick))
+        result.extend(run)
+    return np.array(result, dtype=int)
+
+
+def _cascade_pick(tied, tie_keys):
+    # Position in tied of the candidate the first deciding stage picks, or None.
+    # As in GroupMechanism.declare_winner, every stage looks at all tied candidates.
+    for key in tie_keys:
+        values = key[tied]
+        best = values == values.max()
+        if best.sum() == 1:
+            return int(np.argmax(best))
+    return None
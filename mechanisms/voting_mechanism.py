@@ -6,7 +6,13 @@ Implements the basic voting calculation method.
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
 
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from mechanisms.ranking import (BudgetAllocation,
+                                RankedResult,
+                                TieBreakStage,
+                                fill_budget,
+                                rank_scores)
 
 @dataclass
 class VotingMechanism(ABC):
@@ -33,5 +39,72 @@ class VotingMechanism(ABC):
             specific implementation (e.g., winner, ranked list of candidates, etc.).
         """
 
-        
+    def candidate_scores(self,
+                         voters: Dict[str, Dict[str, Any]],
+                         voter_choices: Dict[str, Any]) -> Tuple[Dict[str, float], Dict[str, Dict[str, float]]]:
+        """
+        Returns the score of each candidate, and any secondary scores that tie-break policies can
+        refer to by name. By default, the scores are those returned by calculate, with no secondary scores.
+        """
+        _, scores = self.calculate(voters, voter_choices)
+        return scores, {}
+
+    def default_tie_break(self) -> List[TieBreakStage]:
+        """The tie-break policy used when none is given. Remaining ties are broken by candidate name."""
+        return []
+
+    def cascade_tie_break(self) -> bool:
+        """
+        Whether the tie-break policy is a cascade, where every stage looks at all tied candidates and
+        decides only if it has a unique best, rather than being compared in order. See mechanisms.ranking.
+        """
+        return False
+
+    def rank(self,
+             voters: Dict[str, Dict[str, Any]],
+             voter_choices: Dict[str, Any],
+             k: Optional[int] = None,
+             tie_break: Optional[Sequence[TieBreakStage]] = None) -> RankedResult:
+        """
+        Ranks the top k candidates, best first, without sorting the full candidate set.
+        If the policy is a cascade that cannot separate the best candidates, raises an UnresolvedTieError.
+
+        Parameters:
+        - voters: As for calculate.
+        - voter_choices: As for calculate.
+        - k: The number of candidates to return. Defaults to all of them.
+        - tie_break: Optional tie-break policy, see mechanisms.ranking. Defaults to default_tie_break().
+
+        Returns:
+        - RankedResult: The top candidates and their scores.
+        """
+        scores, tie_scores = self.candidate_scores(voters, voter_choices)
+        policy = tie_break if tie_break is not None else self.default_tie_break()
+        return rank_scores(scores, k, policy, tie_scores, self.cascade_tie_break())
+
+    def allocate_budget(self,
+                        voters: Dict[str, Dict[str, Any]],
+                        voter_choices: Dict[str, Any],
+                        costs: Dict[str, float],
+                        budget: float,
+                        tie_break: Optional[Sequence[TieBreakStage]] = None,
+                        skip_unaffordable: bool = True) -> BudgetAllocation:
+        """
+        Multi-winner allocation: funds candidates in score order until the budget runs out.
+        If the policy is a cascade that cannot separate the best candidates, raises an UnresolvedTieError.
+
+        Parameters:
+        - voters: As for calculate.
+        - voter_choices: As for calculate.
+        - costs: The cost of each candidate.
+        - budget: The total budget.
+        - tie_break: Optional tie-break policy, see mechanisms.ranking. Defaults to default_tie_break().
+        - skip_unaffordable: See mechanisms.ranking.fill_budget.
 
+        Returns:
+        - BudgetAllocation: The funded candidates and the cut-off.
+        """
+        scores, tie_scores = self.candidate_scores(voters, voter_choices)
+        policy = tie_break if tie_break is not None else self.default_tie_break()
+        return fill_budget(scores, costs, budget, policy, tie_scores, skip_unaffordable,
+                           self.cascade_tie_break())
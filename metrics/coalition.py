@@ -0,0 +1,335 @@
+"""coalition.py
+
+Finds the cheapest set of voters whose switch flips the winner of an election.
+
+Where the Nakamoto coefficient counts how many voters it takes to control an election,
+this answers how much it costs, given a cost for bribing or convincing each voter.
+
+Every mechanism here can be written so that a voter switching their whole ballot to a
+challenger moves the gap between the winner and the challenger by a fixed amount:
+- Weighted plurality, PercentageAllocation and RankAndSlide, in score space.
+- Quadratic credibility, in square root space (candidates are compared by sum of sqrt(points)).
+- GroupHug, in group share space, as switching a voter does not change the group totals.
+Flipping the winner is then a covering knapsack problem: pick voters whose gains add up to more
+than the gap, at minimum cost. For the linear mechanisms it is solved exactly by dynamic programming:
+over cost when costs are whole numbers (one per voter, NFT counts, weights under whole NFT weights),
+otherwise over integerized gains. Quadratic credibility and GroupHug use greedy selection with a
+linear programming lower bound.
+"""
+
+from dataclasses import dataclass, replace
+from typing import Dict, List, Literal, Optional, Union
+
+import numpy as np
+
+from mechanisms.electorate import (Electorate,
+                                   LINEAR_MECHANISMS,
+                                   weighted_scores,
+                                   quadratic_credibility_points,
+                                   quadratic_credibility_scores)
+from mechanisms.group_hug_mechanism import GroupHug
+from mechanisms.group_mechanism import GroupMechanism
+from mechanisms.rank_n_slide_mechanism import DEFAULT_NFT_WEIGHTS
+
+# Largest number of integer steps in the dynamic programming table
+DEFAULT_MAX_UNITS = 20_000
+
+
+@dataclass
+class Coalition:
+    """
+    The cheapest coalition found for one mechanism.
+
+    Attributes:
+        mechanism (str): The mechanism that was analysed.
+        winner (str): The winner before the coalition switches.
+        challenger (str): The candidate the coalition switches to.
+        voters (List[str]): The voter IDs in the coalition.
+        cost (float): The total cost of the coalition.
+        lower_bound (float): A lower bound on the cost of any coalition that flips the winner,
+            over all challengers. For GroupHug it ignores the rounding of shares.
+        exact (bool): True if the coalition is proven to be the cheapest one.
+        flips (bool): True if re-running the mechanism with the switched ballots confirms
+            that the winner loses.
+    """
+    mechanism: str
+    winner: str
+    challenger: str
+    voters: List[str]
+    cost: float
+    lower_bound: float
+    exact: bool
+    flips: bool
+
+    @property
+    def optimality_gap(self) -> float:
+        """How far the cost can be above the optimum, as a fraction of the cost."""
+        if self.cost == 0:
+            return 0.0
+        return (self.cost - self.lower_bound) / self.cost
+
+
+def voter_costs(electorate: Electorate,
+                cost_model: Union[Literal["per_voter", "weight", "nft_count"], np.ndarray] = "per_voter",
+                credential_weights: Dict[str, float] = DEFAULT_NFT_WEIGHTS) -> np.ndarray:
+    """
+    Returns the cost of each voter joining a coalition.
+
+    Parameters:
+    - cost_model: "per_voter" for a cost of 1 per voter, "weight" for a cost equal to the voter's
+        weight, "nft_count" for a cost equal to the number of NFTs held, or an array of costs.
+    - credential_weights: Used when cost_model is "weight".
+    """
+    if isinstance(cost_model, np.ndarray):
+        return cost_model.astype(float)
+    if cost_model == "per_voter":
+        return np.ones(electorate.num_voters)
+    if cost_model == "weight":
+        return electorate.voter_weights(credential_weights)
+    if cost_model == "nft_count":
+        return electorate.credential_matrix.sum(axis=1)
+    raise ValueError(f"Unknown cost model: {cost_model}")
+
+
+def min_cost_coalition(electorate: Electorate,
+                       mechanism: str = "weighted_plurality",
+                       cost_model: Union[str, np.ndarray] = "per_voter",
+                       credential_weights: Dict[str, float] = DEFAULT_NFT_WEIGHTS,
+                       group_hug: Optional[GroupMechanism] = None,
+                       max_units: int = DEFAULT_MAX_UNITS) -> Optional[Coalition]:
+    """
+    Finds the cheapest coalition of voters that flips the winner, by all switching to one challenger.
+
+    Parameters:
+    - electorate: The electorate, with the ballots that were cast.
+    - mechanism: One of MECHANISMS, see mechanisms.electorate.
+    - cost_model: See voter_costs.
+    - credential_weights: The NFT weights for voter weights, points and the "weight" cost model.
+    - group_hug: The GroupHug, or other GroupMechanism, to analyse. Defaults to GroupHug().
+    - max_units: Largest number of integer steps in the dynamic programming table.
+        If neither the costs nor the gains fit, gains are rounded down to coarser steps and
+        the result is no longer exact.
+
+    Returns:
+    - Coalition: The cheapest coalition over all challengers, or None if no coalition can flip the winner.
+        A coalition confirmed to flip the winner is always preferred over one that is not.
+    """
+    if group_hug is None:
+        group_hug = GroupHug()
+
+    contributions, full_contributions = _switch_contributions(electorate, mechanism,
+                                                              credential_weights, group_hug)
+    costs = voter_costs(electorate, cost_model, credential_weights)
+    standing = contributions.sum(axis=0)
+    winner = int(np.argmax(standing))
+
+    best = None
+    lower_bound = np.inf
+    all_exact = True
+    for challenger in range(len(electorate.candidates)):
+        if challenger == winner:
+            continue
+
+        # What each voter closes of the gap between winner and challenger by switching
+        gains = full_contributions - contributions[:, challenger] + contributions[:, winner]
+        gap = standing[winner] - standing[challenger]
+
+        if mechanism in LINEAR_MECHANISMS:
+            found = _knapsack_cover(gains, costs, gap, max_units)
+        else:
+            found = _greedy_cover(gains, costs, gap)
+        if found is None:
+            continue
+
+        members, challenger_bound, exact = found
+        # The cheapest coalition may switch to any challenger, so the bound is the lowest of all
+        lower_bound = min(lower_bound, challenger_bound)
+        all_exact = all_exact and exact
+        cost = float(costs[members].sum())
+        # Confirming can only add voters, so this challenger cannot beat a cheaper confirmed coalition
+        if best is not None and best.flips and cost >= best.cost:
+            continue
+
+        flips = _confirm_flip(electorate, mechanism, credential_weights, group_hug,
+                              members, challenger, winner)
+        if not flips and not exact:
+            # GroupHug rounds its shares, which can leave a bare majority as a tie.
+            # Keep adding the next cheapest voters until the flip is confirmed.
+            in_coalition = set(members)
+            remaining = [i for i in _ratio_order(gains, costs) if i not in in_coalition]
+            while not flips and remaining:
+                members = np.sort(np.append(members, remaining.pop(0)))
+                flips = _confirm_flip(electorate, mechanism, credential_weights, group_hug,
+                                      members, challenger, winner)
+            cost = float(costs[members].sum())
+
+        if best is None or (flips and not best.flips) or (flips == best.flips and cost < best.cost):
+            best = Coalition(mechanism, electorate.candidates[winner], electorate.candidates[challenger],
+                             [electorate.voter_ids[i] for i in members],
+                             cost, 0.0, False, flips)
+
+    if best is not None:
+        best.lower_bound = float(lower_bound)
+        best.exact = all_exact and best.flips
+    return best
+
+
+def _switch_contributions(electorate, mechanism, credential_weights, group_hug):
+    # Returns each voter's current contribution to each candidate, and what they would contribute
+    # to a candidate if they gave it their whole ballot. Contributions add up to the standing.
+    proportions = electorate.proportions()
+
+    if mechanism in LINEAR_MECHANISMS:
+        weights = electorate.voter_weights(credential_weights)
+        return weights[:, None] * proportions, weights
+
+    if mechanism == "quadratic_credibility":
+        points = quadratic_credibility_points(electorate.voter_weights(credential_weights))
+        return np.sqrt(points[:, None] * proportions), np.sqrt(points)
+
+    if mechanism == "group_hug":
+        # Share of each group carried by each voter, times the weight of the group
+        members = group_hug.group_member_weights(electorate)
+        totals = (members.T @ proportions).sum(axis=1)
+        scale = np.divide(100 * group_hug.group_weight_vector(), totals,
+                          out=np.zeros_like(totals), where=totals != 0)
+        full = members @ scale
+        return full[:, None] * proportions, full
+
+    raise ValueError(f"Unknown mechanism: {mechanism}")
+
+
+def _knapsack_cover(gains, costs, gap, max_units):
+    # Exact minimum cost cover by dynamic programming, over cost if costs are whole numbers,
+    # otherwise over integer gains. best[j] is the cheapest cost reaching a total gain of at least j units.
+    useful = np.flatnonzero(gains > 0)
+    if gains[useful].sum() <= gap:
+        return None
+
+    useful_costs = costs[useful]
+    if np.all(useful_costs >= 0) and np.allclose(useful_costs, np.round(useful_costs)):
+        # The greedy cover is a feasible coalition, so the optimum costs no more than it does
+        greedy_members, _, _ = _greedy_cover(gains, costs, gap)
+        budget = int(round(costs[greedy_members].sum()))
+        if budget + 1 <= max_units:
+            return _cost_knapsack_cover(gains, costs, gap, useful, budget)
+
+    # Integerize, exactly if all gains are whole numbers and fit in the table
+    needed = max(gap, 0)
+    unit = 1.0
+    whole = np.allclose(gains[useful], np.round(gains[useful]))
+    if not whole or needed + 1 > max_units:
+        unit = (needed + gains[useful].max()) / max_units
+        whole = False
+    units = np.floor(gains[useful] / unit + 1e-9).astype(int)
+    target = int(np.floor(needed / unit + 1e-9)) + 1
+
+    best = np.full(target + 1, np.inf)
+    best[0] = 0.0
+    taken = []
+    for item_units, item_cost in zip(units, costs[useful]):
+        candidate = np.empty_like(best)
+        reach = min(item_units, target + 1)
+        candidate[:reach] = best[0]
+        candidate[reach:] = best[:target + 1 - reach]
+        candidate += item_cost
+        better = candidate < best
+        best = np.where(better, candidate, best)
+        taken.append(np.packbits(better))
+
+    if not np.isfinite(best[target]):
+        # Rounding down left too little gain, fall back to the greedy cover
+        return _greedy_cover(gains, costs, gap)
+
+    members = []
+    j = target
+    for k in range(len(useful) - 1, -1, -1):
+        if np.unpackbits(taken[k], count=target + 1)[j]:
+            members.append(useful[k])
+            j = max(j - units[k], 0)
+    members = np.array(sorted(members), dtype=int)
+
+    lower_bound = float(best[target]) if whole else _fractional_cover_cost(gains, costs, gap)
+    return members, lower_bound, whole
+
+
+def _cost_knapsack_cover(gains, costs, gap, useful, budget):
+    # Exact minimum cost cover for whole number costs. best[c] is the largest total gain of
+    # voters costing at most c together. Gains stay floats, so nothing is rounded.
+    item_costs = np.round(costs[useful]).astype(int)
+    best = np.zeros(budget + 1)
+    taken = []
+    for item_cost, item_gain in zip(item_costs, gains[useful]):
+        candidate = np.full(budget + 1, -np.inf)
+        if item_cost <= budget:
+            candidate[item_cost:] = best[:budget + 1 - item_cost] + item_gain
+        better = candidate > best
+        best = np.where(better, candidate, best)
+        taken.append(np.packbits(better))
+
+    cheapest = int(np.flatnonzero(best > gap)[0])
+    members = []
+    j = cheapest
+    for k in range(len(useful) - 1, -1, -1):
+        if np.unpackbits(taken[k], count=budget + 1)[j]:
+            members.append(useful[k])
+            j -= item_costs[k]
+    return np.array(sorted(members), dtype=int), float(cheapest), True
+
+
+def _greedy_cover(gains, costs, gap):
+    # Takes voters in order of cost per unit of gain until the gap is closed,
+    # then drops any voter the coalition no longer needs.
+    useful = np.flatnonzero(gains > 0)
+    if gains[useful].sum() <= gap:
+        return None
+
+    order = _ratio_order(gains, costs)
+    closed = np.cumsum(gains[order])
+    members = list(order[:int(np.searchsorted(closed, gap, side="right")) + 1])
+
+    total = gains[members].sum()
+    for i in sorted(members, key=lambda i: -costs[i]):
+        if total - gains[i] > gap:
+            members.remove(i)
+            total -= gains[i]
+
+    return np.array(sorted(members), dtype=int), _fractional_cover_cost(gains, costs, gap), False
+
+
+def _ratio_order(gains, costs):
+    # Voters that close part of the gap, cheapest per unit of gain first
+    useful = np.flatnonzero(gains > 0)
+    return useful[np.argsort(costs[useful] / gains[useful], kind="stable")]
+
+
+def _fractional_cover_cost(gains, costs, gap):
+    # Linear programming relaxation: voters can join fractionally, so taking them in order of
+    # cost per unit of gain is optimal. This is a lower bound on any real coalition.
+    if gap <= 0:
+        return 0.0
+    order = _ratio_order(gains, costs)
+    closed = np.cumsum(gains[order])
+    last = int(np.searchsorted(closed, gap, side="left"))
+    before = closed[last - 1] if last > 0 else 0.0
+    fraction = (gap - before) / gains[order[last]]
+    return float(costs[order[:last]].sum() + fraction * costs[order[last]])
+
+
+def _confirm_flip(electorate, mechanism, credential_weights, group_hug, members, challenger, winner):
+    # Re-scores the election with the coalition's ballots given fully to the challenger
+    ballots = electorate.ballot_matrix.copy()
+    ballots[members] = 0
+    ballots[members, challenger] = 1
+    switched = replace(electorate, ballot_matrix=ballots)
+
+    proportions = switched.proportions()
+    weights = switched.voter_weights(credential_weights)
+    if mechanism in LINEAR_MECHANISMS:
+        scores = weighted_scores(weights, proportions)
+    elif mechanism == "quadratic_credibility":
+        scores = quadratic_credibility_scores(quadratic_credibility_points(weights)[:, None] * proportions)
+    else:
+        scores, _ = group_hug.vote_arrays(switched)
+
+    return bool(scores[challenger] > scores[winner])
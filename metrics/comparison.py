@@ -0,0 +1,231 @@
+"""comparison.py
+
+Compares the mechanisms on the same electorate and ballots, in one pass.
+
+The voter and ballot dictionaries are read once into an Electorate, and the intermediates every
+mechanism needs are computed once: voter weights, normalized proportions and QCV points. Each
+mechanism is then a few array operations on those intermediates, optionally run in parallel,
+so the whole comparison costs little more than the most expensive mechanism (usually GroupHug).
+The result is one table, with a row per mechanism, and the time spent in each stage.
+
+Quadratic credibility is scored as if every ballot spends all of the voter's points: each voter's
+points come from their credentials, and are split in the proportions of their ballot.
+SingleChoiceQuadraticCredibility.calculate instead takes the point amounts on the ballots as they
+are, so the two only agree when every voter spends exactly their points.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from mechanisms.ballot_validation import validate_ballots
+from mechanisms.electorate import (Electorate,
+                                   DEFAULT_MECHANISMS,
+                                   LINEAR_MECHANISMS,
+                                   MECHANISMS,
+                                   weighted_scores,
+                                   quadratic_credibility_points,
+                                   quadratic_credibility_scores)
+from mechanisms.group_hug_mechanism import GroupHug
+from mechanisms.group_mechanism import GroupMechanism
+from mechanisms.rank_n_slide_mechanism import DEFAULT_NFT_WEIGHTS
+from mechanisms.ranking import top_k
+from metrics.plutocracy import nakamoto_coefficients, gini_coefficients, max_voter_shares
+from metrics.robustness import bootstrap_robustness
+
+
+@dataclass
+class MechanismComparison:
+    """
+    The result of every mechanism on one electorate.
+
+    Attributes:
+        table (pd.DataFrame): One row per mechanism with the winner, runner-up, the winner's share of
+            the total score, the margin over the runner-up in percentage points, the time the mechanism
+            took and, if replicates were drawn, the winner's win probability. Exact ties go to the
+            candidate first by name, in the table and the win probabilities alike. GroupHug breaks
+            them by its tie_break_order instead, and has no winner if that cannot break them.
+        scores (Dict[str, Dict[str, float]]): The score of each candidate, per mechanism.
+        electorate_metrics (Dict[str, float]): Concentration metrics of the voter weights.
+        timings (Dict[str, float]): Seconds spent in each stage.
+        rejections (Dict[str, List[str]]): Ballots rejected by validation, if it was run.
+    """
+    table: pd.DataFrame
+    scores: Dict[str, Dict[str, float]]
+    electorate_metrics: Dict[str, float]
+    timings: Dict[str, float]
+    rejections: Dict[str, List[str]]
+
+
+def compare_mechanisms(voter_credentials: Dict[str, Dict[str, Any]],
+                       voter_choices: Dict[str, Any],
+                       mechanisms: Sequence[str] = DEFAULT_MECHANISMS,
+                       credential_weights: Dict[str, float] = DEFAULT_NFT_WEIGHTS,
+                       group_hug: Optional[GroupMechanism] = None,
+                       validate: bool = False,
+                       replicates: int = 0,
+                       max_workers: Optional[int] = None,
+                       seed: Optional[int] = None) -> MechanismComparison:
+    """
+    Evaluates several mechanisms on the same voters and ballots.
+
+    Parameters:
+    - voter_credentials: A dictionary where each key is a voter ID and the value is a dictionary
+        of (credential, amount) pairs.
+    - voter_choices: A dictionary where each key is a voter ID and the value is either the chosen
+        candidate, or a dictionary of (candidate, amount) pairs.
+    - mechanisms: Any of MECHANISMS, see mechanisms.electorate.
+    - credential_weights: The NFT weights for voter weights and QCV points. Every ballot is taken to
+        spend all of the voter's QCV points, see the module docstring.
+        GroupHug uses its own nft_weights.
+    - group_hug: The GroupHug, or other GroupMechanism, for "group_hug". Defaults to GroupHug().
+    - validate: If True, ballots are checked with validate_ballots first, and rejected ballots are left out.
+        The checks run on the ballot matrix of the Electorate built in the parse stage.
+    - replicates: If more than 0, the number of bootstrap replicates used to estimate each winner's
+        win probability, see bootstrap_robustness.
+    - max_workers: If more than 1, mechanisms are evaluated in that many threads.
+    - seed: Seed for the bootstrap replicates.
+
+    Returns:
+    - MechanismComparison: The comparison table, scores, metrics and timings.
+    """
+    for name in mechanisms:
+        if name not in MECHANISMS:
+            raise ValueError(f"Unknown mechanism: {name}")
+    if group_hug is None:
+        group_hug = GroupHug()
+    timings = {}
+
+    # Stage 1: parse the dictionaries once
+    start = time.perf_counter()
+    rejections = {}
+    try:
+        electorate = Electorate.from_dicts(voter_credentials, voter_choices)
+    except (TypeError, ValueError):
+        # An amount that is not a number does not fit in the ballot matrix
+        if not validate:
+            raise
+        electorate = None
+    timings["parse"] = time.perf_counter() - start
+    if validate:
+        # The checks are masks over the ballot matrix just built, if there is one
+        start = time.perf_counter()
+        validated = validate_ballots(voter_credentials, voter_choices, electorate=electorate)
+        electorate = validated.electorate(electorate if electorate is not None else voter_credentials)
+        rejections = validated.rejections
+        timings["validate"] = time.perf_counter() - start
+
+    # Stage 2: intermediates shared by the mechanisms
+    start = time.perf_counter()
+    voter_weights = electorate.voter_weights(credential_weights)
+    proportions = electorate.proportions()
+    points = quadratic_credibility_points(voter_weights)
+    timings["intermediates"] = time.perf_counter() - start
+
+    # Stage 3: every mechanism from the intermediates, with the indices of the winner and runner-up
+    def evaluate(name):
+        start = time.perf_counter()
+        if name in LINEAR_MECHANISMS:
+            scores = weighted_scores(voter_weights, proportions)
+        elif name == "quadratic_credibility":
+            # Each voter's points, split in the proportions of their ballot
+            scores = quadratic_credibility_scores(points[:, None] * proportions)
+        else:
+            scores, shares = _group_scores(group_hug, electorate, voter_choices)
+            return scores, _group_ranked(group_hug, scores, shares, electorate.candidates), \
+                time.perf_counter() - start
+        # Exact ties go to the candidate first by name, as in bootstrap_robustness
+        return scores, top_k(scores, 2, names=electorate.candidates), time.perf_counter() - start
+
+    start = time.perf_counter()
+    if max_workers is not None and max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = dict(zip(mechanisms, executor.map(evaluate, mechanisms)))
+    else:
+        results = {name: evaluate(name) for name in mechanisms}
+    timings["mechanisms"] = time.perf_counter() - start
+    for name, (_, _, seconds) in results.items():
+        timings[name] = seconds
+
+    # Stage 4: metrics
+    start = time.perf_counter()
+    rows = []
+    for name, (scores, ranked, seconds) in results.items():
+        total = scores.sum()
+        shares = 100 * scores / total if total else np.zeros_like(scores)
+        winner = ranked[0] if len(ranked) else None
+        runner_up = ranked[1] if len(ranked) > 1 else None
+        rows.append({"mechanism": name,
+                     "winner": electorate.candidates[winner] if winner is not None else None,
+                     "runner_up": electorate.candidates[runner_up] if runner_up is not None else None,
+                     "winner_share": shares[winner] if winner is not None else np.nan,
+                     "margin": shares[winner] - shares[runner_up] if runner_up is not None else np.nan,
+                     "seconds": seconds})
+    electorate_metrics = {"voters": electorate.num_voters,
+                          "candidates": len(electorate.candidates),
+                          "nakamoto": int(nakamoto_coefficients(voter_weights)) if electorate.num_voters else 0,
+                          "gini": float(gini_coefficients(voter_weights)) if electorate.num_voters else 0.0,
+                          "max_share": float(max_voter_shares(voter_weights)) if electorate.num_voters else 0.0}
+    timings["metrics"] = time.perf_counter() - start
+
+    table = pd.DataFrame(rows).set_index("mechanism")
+    # Object columns, so that a mechanism without a winner shows None rather than NaN
+    for column in ["winner", "runner_up"]:
+        table[column] = pd.Series([row[column] for row in rows], index=table.index, dtype=object)
+
+    # Optional stage 5: how often each winner wins when the electorate is resampled
+    if replicates > 0 and electorate.candidates:
+        start = time.perf_counter()
+        robustness = bootstrap_robustness(electorate, mechanisms, replicates,
+                                          credential_weights=credential_weights,
+                                          group_hug=group_hug, seed=seed)
+        table["win_probability"] = [
+            robustness[name].win_probability[electorate.candidates.index(winner)]
+            if winner is not None else np.nan
+            for name, winner in zip(table.index, table["winner"])]
+        timings["robustness"] = time.perf_counter() - start
+
+    return MechanismComparison(table,
+                               {name: electorate.to_dict(scores) for name, (scores, _, _) in results.items()},
+                               electorate_metrics,
+                               timings,
+                               rejections)
+
+
+def _group_ranked(group_mechanism, result, shares, candidates):
+    # The winner as GroupMechanism.calculate declares it, by the cascade of tie_break_order,
+    # then the runner-up. No one, if the tie cannot be broken.
+    if len(result) == 0:
+        return np.zeros(0, dtype=int)
+    winner = int(group_mechanism.declare_winners(result, shares))
+    if winner < 0:
+        return np.zeros(0, dtype=int)
+    names = group_mechanism.group_names()
+    tie_keys = [shares[names.index(group)] for group in group_mechanism.tie_break_order]
+    runner_up = top_k(result, 2, tie_keys, candidates, cascade=True)[1:]
+    return np.concatenate([[winner], runner_up]).astype(int)
+
+
+def _group_scores(group_mechanism, electorate, voter_choices):
+    # GroupMechanism.calculate adds percentages up in the candidate order of set(voter_choices.values()),
+    # which can move rounded results by 0.1. Use the same order here, so the results match calculate.
+    candidates = electorate.candidates
+    if all(not isinstance(choice, dict) for choice in voter_choices.values()):
+        column = {candidate: j for j, candidate in enumerate(candidates)}
+        order = [column[candidate] for candidate in set(voter_choices.values()) if candidate in column]
+        placed = set(order)
+        order += [j for j in range(len(candidates)) if j not in placed]
+    else:
+        order = list(range(len(candidates)))
+    reordered = replace(electorate,
+                        candidates=[candidates[j] for j in order],
+                        ballot_matrix=electorate.ballot_matrix[:, order])
+    result, shares = group_mechanism.vote_arrays(reordered)
+
+    # Back to the electorate's candidate order
+    inverse = np.argsort(order)
+    return result[inverse], shares[:, inverse]
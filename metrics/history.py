@@ -0,0 +1,314 @@
+"""history.py
+
+Keeps the history of an electorate as a series of dated snapshot diffs, and replays it
+to give a time series of concentration metrics and hypothetical winners.
+
+Each diff lists the addresses that were added, removed, or whose token balances changed.
+Replaying a diff only touches those addresses: their old contributions are taken out of the
+standing tallies and their new contributions are put in. Concentration metrics are kept
+from a histogram of voter weights, as weights are sums of a few NFT weights and take far fewer
+distinct values than there are voters. The cost of each step scales with the churn,
+not with the size of the electorate.
+"""
+
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from mechanisms.electorate import Electorate, DEFAULT_TOTAL_POINTS
+from mechanisms.group_hug_mechanism import GroupHug
+from mechanisms.group_mechanism import GroupMechanism
+from mechanisms.rank_n_slide_mechanism import DEFAULT_NFT_WEIGHTS
+from mechanisms.ranking import batch_winners
+
+# Voter weights are rounded to this many decimals in the weight histogram
+HISTOGRAM_DECIMALS = 9
+
+# Columns of the NFT balance exports that are not credentials
+ID_COLUMNS = ["Id", "ID"]
+INDEX_COLUMNS = ["Unnamed: 0"]
+# Columns added by processing an export, such as data/processed_2024-06-19_nft_balances.csv
+NON_CREDENTIAL_COLUMNS = ["tef_graduate"]
+
+
+@dataclass
+class SnapshotDiff:
+    """
+    The changes from one snapshot of the electorate to the next.
+
+    Attributes:
+        date (str): The date of the newer snapshot.
+        added (Dict[str, Dict[str, float]]): New addresses, with their holdings.
+        removed (List[str]): Addresses that are no longer in the snapshot.
+        changed (Dict[str, Dict[str, float]]): For addresses in both snapshots, the new balance
+            of each credential whose balance changed.
+    """
+    date: str
+    added: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    removed: List[str] = field(default_factory=list)
+    changed: Dict[str, Dict[str, float]] = field(default_factory=dict)
+
+    @property
+    def churn(self) -> int:
+        """The number of addresses touched by this diff."""
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+
+def load_snapshot(file_name: str,
+                  rename: Optional[Dict[str, str]] = None,
+                  exclude: Optional[List[str]] = None) -> Dict[str, Dict[str, float]]:
+    """
+    Reads an NFT balance export, such as data/2024-06-19_nft_balances.csv, into
+    the nested dictionary form {address: {credential: balance}}.
+    Only non-zero balances are kept.
+
+    Exports do not all name credentials the same way: the May 2024 export uses CodeNames such as
+    FUND_AUTHOR, the June 2024 export uses "tokenId 1" to "tokenId 45". Snapshots can only be diffed
+    against each other, and weighted, once their columns are renamed to the same credential names.
+
+    Parameters:
+    - file_name: The CSV export.
+    - rename: Optional mapping from column names in the export to credential names.
+    - exclude: Columns that are not credentials. Defaults to NON_CREDENTIAL_COLUMNS.
+    """
+    table = pd.read_csv(file_name)
+    exclude = NON_CREDENTIAL_COLUMNS if exclude is None else exclude
+    table = table.drop(columns=[column for column in INDEX_COLUMNS + list(exclude) if column in table.columns])
+    if rename:
+        table = table.rename(columns=rename)
+    id_column = next(column for column in ID_COLUMNS if column in table.columns)
+    table = table.set_index(id_column)
+    return {address: {credential: balance for credential, balance in holdings.items() if balance}
+            for address, holdings in table.to_dict(orient="index").items()}
+
+
+def diff_snapshots(old: Dict[str, Dict[str, float]],
+                   new: Dict[str, Dict[str, float]],
+                   date: str) -> SnapshotDiff:
+    """
+    Computes the diff that turns the old snapshot into the new one.
+    Missing credentials count as a balance of 0.
+
+    Raises a ValueError if both snapshots hold credentials but share none of their names, which
+    means they were exported with different column names, see load_snapshot.
+    """
+    old_credentials = {credential for holdings in old.values() for credential in holdings}
+    new_credentials = {credential for holdings in new.values() for credential in holdings}
+    if old_credentials and new_credentials and old_credentials.isdisjoint(new_credentials):
+        raise ValueError(f"The snapshot of {date} shares no credential names with the one before it. "
+                         "Use load_snapshot's rename to give both the same names.")
+    diff = SnapshotDiff(date)
+    for address, holdings in new.items():
+        if address not in old:
+            diff.added[address] = dict(holdings)
+            continue
+        before = old[address]
+        changes = {credential: balance
+                   for credential, balance in holdings.items()
+                   if balance != before.get(credential, 0)}
+        changes.update({credential: 0
+                        for credential, balance in before.items()
+                        if balance and credential not in holdings})
+        if changes:
+            diff.changed[address] = changes
+    diff.removed = [address for address in old if address not in new]
+    return diff
+
+
+def apply_diff(snapshot: Dict[str, Dict[str, float]],
+               diff: SnapshotDiff) -> Dict[str, Dict[str, float]]:
+    """
+    Returns the snapshot that results from applying a diff to another snapshot.
+    """
+    removed = set(diff.removed)
+    result = {address: holdings for address, holdings in snapshot.items()
+              if address not in removed}
+    for address, changes in diff.changed.items():
+        holdings = dict(result[address])
+        holdings.update(changes)
+        result[address] = {credential: balance for credential, balance in holdings.items() if balance}
+    result.update(diff.added)
+    return result
+
+
+class ElectorateHistory:
+    """
+    The history of an electorate, stored as a first snapshot and a diff for each later snapshot.
+
+    Attributes:
+        start_date (str): The date of the first snapshot.
+        start (Dict[str, Dict[str, float]]): The first snapshot.
+        diffs (List[SnapshotDiff]): The diff to each later snapshot, in date order.
+    """
+
+    def __init__(self, start_date: str, start: Dict[str, Dict[str, float]]):
+        self.start_date = start_date
+        self.start = start
+        self.diffs = []
+        # The newest snapshot, kept so that new snapshots can be diffed against it
+        self.latest = start
+
+    def add_snapshot(self, date: str, snapshot: Dict[str, Dict[str, float]]) -> SnapshotDiff:
+        """Stores a newer snapshot as a diff from the latest one, and returns the diff."""
+        diff = diff_snapshots(self.latest, snapshot, date)
+        self.diffs.append(diff)
+        self.latest = snapshot
+        return diff
+
+    def dates(self) -> List[str]:
+        return [self.start_date] + [diff.date for diff in self.diffs]
+
+    def snapshot(self, date: str) -> Dict[str, Dict[str, float]]:
+        """Rebuilds the snapshot of a given date by applying the diffs up to it."""
+        snapshot = self.start
+        if date == self.start_date:
+            return snapshot
+        for diff in self.diffs:
+            snapshot = apply_diff(snapshot, diff)
+            if diff.date == date:
+                return snapshot
+        raise KeyError(f"No snapshot for date {date}")
+
+    def replay(self,
+               credential_weights: Dict[str, float] = DEFAULT_NFT_WEIGHTS,
+               voter_choices: Optional[Dict[str, Any]] = None,
+               group_hug: Optional[GroupMechanism] = None) -> pd.DataFrame:
+        """
+        Replays the history, updating weights, metrics and tallies from each diff.
+
+        Parameters:
+        - credential_weights: The NFT weights for voter weights and points.
+        - voter_choices: Optional standing ballots, as a dictionary where each key is a voter ID and
+            the value is a candidate or a dictionary of (candidate, amount) pairs. Addresses without
+            a ballot count towards concentration metrics and QCV points, but do not vote.
+        - group_hug: The GroupHug, or other GroupMechanism, for the GroupHug winner. Defaults to GroupHug().
+
+        Returns:
+        - pd.DataFrame: One row per date with the number of voters, churn, total weight,
+            Nakamoto coefficient, Gini coefficient, largest voter share and, if there are ballots,
+            the winner of each mechanism. Exact ties go to the candidate first by name, except for
+            GroupHug, which breaks them by its tie_break_order, and has no winner (None) if that cannot.
+        """
+        tally = _IncrementalTally(credential_weights, voter_choices or {},
+                                  group_hug if group_hug is not None else GroupHug())
+        rows = []
+
+        tally.update(removed={}, added=self.start)
+        rows.append(tally.summary(self.start_date, churn=len(self.start)))
+
+        current = dict(self.start)
+        for diff in self.diffs:
+            removed = {address: current[address]
+                       for address in list(diff.removed) + list(diff.changed)}
+            added = dict(diff.added)
+            for address, changes in diff.changed.items():
+                holdings = dict(current[address])
+                holdings.update(changes)
+                added[address] = {credential: balance for credential, balance in holdings.items() if balance}
+
+            tally.update(removed=removed, added=added)
+            for address in diff.removed:
+                del current[address]
+            current.update(added)
+
+            rows.append(tally.summary(diff.date, churn=diff.churn))
+
+        table = pd.DataFrame(rows).set_index("date")
+        # Object columns, so that a date without a GroupHug winner shows None rather than NaN
+        for column in [column for column in table.columns if column.startswith("winner_")]:
+            table[column] = pd.Series([row[column] for row in rows], index=table.index, dtype=object)
+        return table
+
+
+class _IncrementalTally:
+    # Standing weights, metrics and tallies, updated by taking voters out and putting them back in
+
+    def __init__(self, credential_weights, voter_choices, group_mechanism):
+        self.credential_weights = credential_weights
+        self.voter_choices = voter_choices
+        self.group_mechanism = group_mechanism
+        self.candidates = list(dict.fromkeys(candidate
+                                             for choice in voter_choices.values()
+                                             for candidate in (choice if isinstance(choice, dict) else [choice])))
+
+        self.voters = 0
+        self.total_weight = 0.0
+        self.weight_histogram = Counter()
+        self.linear_scores = np.zeros(len(self.candidates))
+        # Sum over voters of sqrt(voter_weight * proportion). QCV scores are this squared,
+        # times total points over total weight, since points are normalized weights.
+        self.root_sums = np.zeros(len(self.candidates))
+        self.group_tallies = np.zeros((len(group_mechanism.groups), len(self.candidates)))
+
+    def update(self, removed, added):
+        for holdings, sign in ((removed, -1), (added, 1)):
+            if not holdings:
+                continue
+            part = Electorate.from_dicts(holdings, self.voter_choices, candidates=self.candidates)
+            weights = part.voter_weights(self.credential_weights)
+            proportions = part.proportions()
+
+            self.voters += sign * part.num_voters
+            self.total_weight += sign * weights.sum()
+            # Rounded, so a voter is taken out under the same key it was put in with
+            values, counts = np.unique(np.round(weights, HISTOGRAM_DECIMALS), return_counts=True)
+            self.weight_histogram.update(dict(zip(values.tolist(), (sign * counts).tolist())))
+            self.linear_scores += sign * (weights @ proportions)
+            self.root_sums += sign * np.sqrt(weights[:, None] * proportions).sum(axis=0)
+            members = self.group_mechanism.group_member_weights(part)
+            self.group_tallies += sign * (members.T @ proportions)
+
+        self.weight_histogram = +self.weight_histogram
+
+    def summary(self, date, churn):
+        values = np.array(sorted(self.weight_histogram))
+        counts = np.array([self.weight_histogram[value] for value in values])
+        row = {"date": date,
+               "voters": self.voters,
+               "churn": churn,
+               "total_weight": self.total_weight,
+               "nakamoto": _histogram_nakamoto(values, counts),
+               "gini": _histogram_gini(values, counts),
+               "max_share": values[-1] / self.total_weight if self.total_weight else 0.0}
+
+        if self.candidates:
+            qcv_scores = np.square(self.root_sums) * (DEFAULT_TOTAL_POINTS / self.total_weight
+                                                      if self.total_weight else 0.0)
+            for name, scores in (("weighted_plurality", self.linear_scores),
+                                 ("quadratic_credibility", qcv_scores)):
+                row[f"winner_{name}"] = self.candidates[int(batch_winners(scores, self.candidates))]
+            # Rounded shares tie often, so the groups in tie_break_order decide, as in calculate
+            winner = int(self.group_mechanism.declare_winners(*self.group_mechanism.combine_tallies(self.group_tallies)))
+            row["winner_group_hug"] = self.candidates[winner] if winner >= 0 else None
+        return row
+
+
+def _histogram_nakamoto(values, counts):
+    # Smallest number of voters, heaviest first, holding more than half of the total weight
+    values, counts = values[::-1], counts[::-1]
+    bucket_weights = values * counts
+    half_total_weight = 0.5 * bucket_weights.sum()
+    if counts.sum() == 0:
+        return 0
+    if half_total_weight == 0:
+        # As nakamoto_coefficients: with no weight at all, one voter is counted
+        return 1
+    cumulative_weight = np.cumsum(bucket_weights)
+    bucket = int(np.argmax(cumulative_weight > half_total_weight))
+    before = cumulative_weight[bucket - 1] if bucket > 0 else 0.0
+    voters_before = counts[:bucket].sum()
+    return int(voters_before + np.floor((half_total_weight - before) / values[bucket]) + 1)
+
+
+def _histogram_gini(values, counts):
+    # Same formula as gini_coefficients, with ranks summed per bucket of equal weights
+    n = counts.sum()
+    total_weight = (values * counts).sum()
+    if total_weight == 0:
+        return 0.0
+    ranks_before = np.cumsum(counts) - counts
+    rank_sums = counts * ranks_before + counts * (counts + 1) / 2
+    return float(2 * (values * rank_sums).sum() / (n * total_weight) - (n + 1) / n)
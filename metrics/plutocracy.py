@@ -1,5 +1,7 @@
 from typing import Dict
 
+import numpy as np
+
 def calc_nakamoto_coefficient(weighted_voters: Dict[str, Dict[str, float]],
                          verbose = False):
     """
@@ -41,4 +43,45 @@ def calc_nakamoto_coefficient(weighted_voters: Dict[str, Dict[str, float]],
     if verbose:
         print(f"The Nakamoto Coefficient is {nakamoto_coefficient}.")
 
-    return nakamoto_coefficient
\ No newline at end of file
+    return nakamoto_coefficient
+
+def nakamoto_coefficients(voter_weights: np.ndarray) -> np.ndarray:
+    """
+    Array version of calc_nakamoto_coefficient, for one or many weightings at once.
+
+    Parameters:
+    - voter_weights: A (voters,) or (batch x voters) array of voter weights.
+
+    Returns:
+    - np.ndarray: The Nakamoto coefficient of each weighting.
+    """
+    sorted_weights = -np.sort(-voter_weights, axis=-1)
+    cumulative_weight = np.cumsum(sorted_weights, axis=-1)
+    half_total_weight = 0.5 * cumulative_weight[..., -1:]
+    return np.argmax(cumulative_weight > half_total_weight, axis=-1) + 1
+
+
+def gini_coefficients(voter_weights: np.ndarray) -> np.ndarray:
+    """
+    Calculates the Gini coefficient of voter weights, for one or many weightings at once.
+    0 means every voter has the same weight, values close to 1 mean one voter has it all.
+    """
+    sorted_weights = np.sort(voter_weights, axis=-1)
+    n = sorted_weights.shape[-1]
+    total_weight = sorted_weights.sum(axis=-1)
+    ranks = np.arange(1, n + 1)
+    weighted_sum = sorted_weights @ ranks
+    return np.divide(2 * weighted_sum, n * total_weight,
+                     out=np.full_like(total_weight, (n + 1) / n, dtype=float),
+                     where=total_weight != 0) - (n + 1) / n
+
+
+def max_voter_shares(voter_weights: np.ndarray) -> np.ndarray:
+    """
+    Calculates the largest share of the total weight held by a single voter,
+    for one or many weightings at once.
+    """
+    total_weight = voter_weights.sum(axis=-1)
+    return np.divide(voter_weights.max(axis=-1), total_weight,
+                     out=np.zeros_like(total_weight, dtype=float),
+                     where=total_weight != 0)
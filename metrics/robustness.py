@@ -0,0 +1,242 @@
+"""robustness.py
+
+Estimates how fragile an election result is: if turnout had been slightly different,
+would the winner change?
+
+Replicate electorates are drawn as multinomial reweightings of the voters (bootstrap), or as
+random subsets of them (subsampling). A replicate is a row of counts, how many times each voter
+takes part, never a copy of the voter dictionaries. All replicates are then scored together:
+- Weighted plurality, PercentageAllocation and RankAndSlide are linear in the counts.
+- Quadratic credibility is a sum of square roots, also linear in the counts once points are renormalized.
+- Group mechanisms such as GroupHug tally each group linearly in the counts, before turning tallies
+  into percentages. Ties are broken by the groups in tie_break_order, as in GroupHug's calculate,
+  and a replicate whose tie cannot be broken counts as a win for no one.
+In the other mechanisms, exact ties go to the candidate first by name, as in compare_mechanisms.
+Other mechanisms can be run on each replicate in a process pool, with bootstrap_mechanism.
+"""
+
+import contextlib
+import io
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import Any, Dict, List, Literal, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from mechanisms.electorate import Electorate, DEFAULT_MECHANISMS, DEFAULT_TOTAL_POINTS, LINEAR_MECHANISMS
+from mechanisms.group_hug_mechanism import GroupHug
+from mechanisms.group_mechanism import GroupMechanism, UnresolvedTieError
+from mechanisms.rank_n_slide_mechanism import DEFAULT_NFT_WEIGHTS
+from mechanisms.ranking import batch_winners
+from mechanisms.voting_mechanism import VotingMechanism
+
+DEFAULT_REPLICATES = 10_000
+DEFAULT_CHUNK_SIZE = 1_000
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_TURNOUT = 0.9
+
+ResamplingMethod = Literal["bootstrap", "subsample"]
+
+
+@dataclass
+class RobustnessResult:
+    """
+    How often each candidate wins across replicate electorates.
+
+    Attributes:
+        mechanism (str): The mechanism that was analysed.
+        candidates (List[str]): The candidates.
+        replicates (int): The number of replicate electorates.
+        wins (np.ndarray): How many replicates each candidate won.
+        win_probability (np.ndarray): The share of replicates each candidate won.
+        lower (np.ndarray): Lower end of the confidence interval of each win probability.
+        upper (np.ndarray): Upper end of the confidence interval of each win probability.
+    """
+    mechanism: str
+    candidates: List[str]
+    replicates: int
+    wins: np.ndarray
+    win_probability: np.ndarray
+    lower: np.ndarray
+    upper: np.ndarray
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Returns the win probabilities as a table, with one row per candidate."""
+        return pd.DataFrame({"wins": self.wins,
+                             "win_probability": self.win_probability,
+                             "lower": self.lower,
+                             "upper": self.upper},
+                            index=pd.Index(self.candidates, name="candidate"))
+
+
+def draw_replicates(num_voters: int,
+                    replicates: int,
+                    method: ResamplingMethod = "bootstrap",
+                    turnout: float = DEFAULT_TURNOUT,
+                    rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """
+    Draws a (replicates x voters) array of how many times each voter takes part in each replicate.
+
+    Parameters:
+    - method: "bootstrap" draws num_voters voters with replacement, "subsample" lets each voter
+        take part with probability turnout.
+    - turnout: The chance of taking part, for "subsample".
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    if method == "bootstrap":
+        return rng.multinomial(num_voters, np.full(num_voters, 1 / num_voters), size=replicates).astype(float)
+    if method == "subsample":
+        return (rng.random((replicates, num_voters)) < turnout).astype(float)
+    raise ValueError(f"Unknown resampling method: {method}")
+
+
+def bootstrap_robustness(electorate: Electorate,
+                         mechanisms: Sequence[str] = DEFAULT_MECHANISMS,
+                         replicates: int = DEFAULT_REPLICATES,
+                         method: ResamplingMethod = "bootstrap",
+                         turnout: float = DEFAULT_TURNOUT,
+                         credential_weights: Dict[str, float] = DEFAULT_NFT_WEIGHTS,
+                         group_hug: Optional[GroupMechanism] = None,
+                         confidence: float = DEFAULT_CONFIDENCE,
+                         chunk_size: int = DEFAULT_CHUNK_SIZE,
+                         seed: Optional[int] = None) -> Dict[str, RobustnessResult]:
+    """
+    Estimates the win probability of each candidate under resampled electorates.
+
+    Parameters:
+    - electorate: The electorate, with the ballots that were cast.
+    - mechanisms: Any of MECHANISMS, see mechanisms.electorate.
+    - replicates: The number of replicate electorates.
+    - method: See draw_replicates.
+    - turnout: See draw_replicates.
+    - credential_weights: The NFT weights for voter weights and points.
+    - group_hug: The GroupHug, or other GroupMechanism, for "group_hug". Defaults to GroupHug().
+    - confidence: The confidence level of the intervals.
+    - chunk_size: The number of replicates scored at once, to bound memory use.
+    - seed: Seed for drawing replicates. All mechanisms see the same replicates.
+
+    Returns:
+    - Dict[str, RobustnessResult]: The result for each mechanism.
+    """
+    if group_hug is None:
+        group_hug = GroupHug()
+    rng = np.random.default_rng(seed)
+
+    proportions = electorate.proportions()
+    weights = electorate.voter_weights(credential_weights)
+    # Per voter contributions, so each replicate is a matrix product with its counts
+    linear_contributions = weights[:, None] * proportions
+    root_contributions = np.sqrt(linear_contributions)
+    if "group_hug" in mechanisms:
+        members = group_hug.group_member_weights(electorate)
+        group_contributions = members[:, :, None] * proportions[:, None, :]
+
+    num_candidates = len(electorate.candidates)
+    wins = {name: np.zeros(num_candidates, dtype=int) for name in mechanisms}
+    for start in range(0, replicates, chunk_size):
+        counts = draw_replicates(electorate.num_voters, min(chunk_size, replicates - start),
+                                 method, turnout, rng)
+
+        for name in mechanisms:
+            if name in LINEAR_MECHANISMS:
+                winners = batch_winners(counts @ linear_contributions, electorate.candidates)
+            elif name == "quadratic_credibility":
+                # Points are renormalized within each replicate: sqrt(total / replicate weight)
+                # scales every candidate the same way, so it does not change the winner,
+                # but it is kept so the scores are the mechanism's own.
+                replicate_weights = counts @ weights
+                scale = np.divide(DEFAULT_TOTAL_POINTS, replicate_weights,
+                                  out=np.zeros_like(replicate_weights), where=replicate_weights != 0)
+                winners = batch_winners(scale[:, None] * np.square(counts @ root_contributions),
+                                        electorate.candidates)
+            elif name == "group_hug":
+                tallies = np.einsum("bn,ngc->bgc", counts, group_contributions)
+                winners = group_hug.declare_winners(*group_hug.combine_tallies(tallies))
+                winners = winners[winners >= 0]
+            else:
+                raise ValueError(f"Unknown mechanism: {name}")
+
+            wins[name] += np.bincount(winners, minlength=num_candidates)
+
+    return {name: _result(name, electorate.candidates, wins[name], replicates, confidence)
+            for name in mechanisms}
+
+
+def bootstrap_mechanism(mechanism: VotingMechanism,
+                        voters: Dict[str, Dict[str, Any]],
+                        voter_choices: Dict[str, Any],
+                        replicates: int = DEFAULT_REPLICATES,
+                        method: ResamplingMethod = "bootstrap",
+                        turnout: float = DEFAULT_TURNOUT,
+                        confidence: float = DEFAULT_CONFIDENCE,
+                        chunk_size: int = DEFAULT_CHUNK_SIZE,
+                        max_workers: Optional[int] = None,
+                        seed: Optional[int] = None) -> RobustnessResult:
+    """
+    Estimates win probabilities for any mechanism, by running its calculate method on each
+    replicate in a process pool. A voter drawn several times takes part under several IDs.
+    This is much slower than bootstrap_robustness and meant for mechanisms it does not cover.
+
+    Parameters:
+    - mechanism: The mechanism. It must be picklable.
+    - voters: The voters, in the form the mechanism's calculate method expects.
+    - voter_choices: The ballots, in the form the mechanism's calculate method expects.
+    - max_workers: The number of worker processes.
+    The other parameters are the same as for bootstrap_robustness.
+    """
+    rng = np.random.default_rng(seed)
+    voter_ids = list(voters.keys())
+    counts = draw_replicates(len(voter_ids), replicates, method, turnout, rng).astype(int)
+    chunks = [counts[start:start + chunk_size] for start in range(0, replicates, chunk_size)]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        winners = [winner
+                   for chunk_winners in executor.map(_run_replicates,
+                                                     [mechanism] * len(chunks),
+                                                     [voters] * len(chunks),
+                                                     [voter_choices] * len(chunks),
+                                                     chunks)
+                   for winner in chunk_winners]
+
+    candidates = list(dict.fromkeys(candidate
+                                    for choice in voter_choices.values()
+                                    for candidate in (choice if isinstance(choice, dict) else [choice])))
+    wins = np.array([winners.count(candidate) for candidate in candidates])
+    return _result(type(mechanism).__name__, candidates, wins, replicates, confidence)
+
+
+def _run_replicates(mechanism, voters, voter_choices, counts):
+    voter_ids = list(voters.keys())
+    winners = []
+    for row in counts:
+        replicate_voters, replicate_choices = {}, {}
+        for voter, count in zip(voter_ids, row):
+            for copy in range(count):
+                copy_id = voter if copy == 0 else f"{voter}#{copy}"
+                replicate_voters[copy_id] = voters[voter]
+                if voter in voter_choices:
+                    replicate_choices[copy_id] = voter_choices[voter]
+        if not replicate_choices:
+            winners.append(None)
+            continue
+        # Mechanisms such as GroupHug print their working
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                winner, _ = mechanism.calculate(replicate_voters, replicate_choices)
+            except UnresolvedTieError:
+                winner = None
+        winners.append(winner)
+    return winners
+
+
+def _result(name, candidates, wins, replicates, confidence):
+    # Wilson score interval for each win probability
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = wins / replicates
+    denominator = 1 + z ** 2 / replicates
+    centre = (p + z ** 2 / (2 * replicates)) / denominator
+    half_width = z * np.sqrt(p * (1 - p) / replicates + z ** 2 / (4 * replicates ** 2)) / denominator
+    return RobustnessResult(name, list(candidates), replicates, wins, p,
+                            np.clip(centre - half_width, 0, 1), np.clip(centre + half_width, 0, 1))
@@ -0,0 +1,196 @@
+"""sensitivity.py
+
+Measures how sensitive an election result is to each entry of the NFT weight table,
+without re-running the mechanism once per question like "what if FUND_AUTHOR was 25?".
+
+The result holds the Jacobian of the candidate scores with respect to every credential weight,
+the gradient of the winner's margin over the runner-up, and the smallest change to a single
+weight that makes the runner-up (or any other candidate) catch up with the winner.
+- Weighted plurality, PercentageAllocation and RankAndSlide are linear in the weights.
+  Their Jacobian and flip points are exact.
+- Quadratic credibility has a closed form derivative. Its flip points are first order estimates.
+- GroupHug uses central finite differences of its unrounded shares, all weights perturbed in one batch.
+  Its flip points are first order estimates.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from mechanisms.electorate import (Electorate,
+                                   LINEAR_MECHANISMS,
+                                   DEFAULT_TOTAL_POINTS,
+                                   weighted_scores,
+                                   quadratic_credibility_points,
+                                   quadratic_credibility_scores)
+from mechanisms.group_hug_mechanism import GroupHug
+from mechanisms.group_mechanism import GroupMechanism
+from mechanisms.rank_n_slide_mechanism import DEFAULT_NFT_WEIGHTS
+
+DEFAULT_FINITE_DIFFERENCE_STEP = 1e-4
+
+
+@dataclass
+class WeightSensitivity:
+    """
+    Sensitivity of one mechanism's result to the credential weights.
+
+    Attributes:
+        mechanism (str): The mechanism that was analysed.
+        candidates (List[str]): The candidates, in row order of jacobian.
+        credentials (List[str]): The credentials, in column order of jacobian.
+        scores (np.ndarray): The score of each candidate.
+        jacobian (np.ndarray): A (candidates x credentials) array with the derivative of each
+            candidate's score with respect to each credential weight.
+        winner (str): The candidate with the highest score.
+        runner_up (str): The candidate with the second highest score.
+        margin (float): The winner's score minus the runner-up's score.
+        margin_gradient (np.ndarray): The derivative of the margin with respect to each credential weight.
+        flip_changes (np.ndarray): For each credential, the smallest change to its weight alone that
+            lets another candidate catch up with the winner. NaN if no change can, within weights >= 0.
+        flip_candidates (List[Optional[str]]): For each credential, the candidate that catches up.
+        exact (bool): Whether the Jacobian and flip changes are exact, or first order estimates.
+    """
+    mechanism: str
+    candidates: List[str]
+    credentials: List[str]
+    scores: np.ndarray
+    jacobian: np.ndarray
+    winner: str
+    runner_up: str
+    margin: float
+    margin_gradient: np.ndarray
+    flip_changes: np.ndarray
+    flip_candidates: List[Optional[str]]
+    exact: bool
+
+    def smallest_flip(self):
+        """
+        Returns the (credential, change, candidate) of the smallest single weight change that
+        flips the winner, or None if no single weight can.
+        """
+        if np.all(np.isnan(self.flip_changes)):
+            return None
+        j = int(np.nanargmin(np.abs(self.flip_changes)))
+        return self.credentials[j], float(self.flip_changes[j]), self.flip_candidates[j]
+
+    def jacobian_dict(self) -> Dict[str, Dict[str, float]]:
+        """Returns the Jacobian as {candidate: {credential: derivative}}."""
+        return {candidate: dict(zip(self.credentials, row.tolist()))
+                for candidate, row in zip(self.candidates, self.jacobian)}
+
+
+def weight_sensitivity(electorate: Electorate,
+                       mechanism: str = "rank_and_slide",
+                       credential_weights: Optional[Dict[str, float]] = None,
+                       group_hug: Optional[GroupMechanism] = None,
+                       step: float = DEFAULT_FINITE_DIFFERENCE_STEP) -> WeightSensitivity:
+    """
+    Computes the sensitivity of a mechanism's result to every credential weight.
+
+    Parameters:
+    - electorate: The electorate, with the ballots that were cast.
+    - mechanism: One of MECHANISMS, see mechanisms.electorate.
+    - credential_weights: The weight table to analyse. Defaults to the NFT weights of RankAndSlide,
+        or the nft_weights of the group mechanism.
+    - group_hug: The GroupHug, or other GroupMechanism, to analyse. Defaults to GroupHug().
+    - step: Relative step for GroupHug's finite differences.
+
+    Returns:
+    - WeightSensitivity: The Jacobian, margin gradient and flip points.
+    """
+    if group_hug is None:
+        group_hug = GroupHug()
+    if credential_weights is None:
+        credential_weights = group_hug.nft_weights if mechanism == "group_hug" else DEFAULT_NFT_WEIGHTS
+
+    weights = electorate.weight_vector(credential_weights)
+    proportions = electorate.proportions()
+
+    if mechanism in LINEAR_MECHANISMS:
+        scores = weighted_scores(electorate.credential_matrix @ weights, proportions)
+        # Scores are sum over voters of (credentials . weights) * proportion
+        jacobian = proportions.T @ electorate.credential_matrix
+    elif mechanism == "quadratic_credibility":
+        scores, jacobian = _quadratic_credibility_jacobian(electorate, weights, proportions)
+    elif mechanism == "group_hug":
+        scores, jacobian = _group_hug_jacobian(electorate, weights, group_hug, step)
+    else:
+        raise ValueError(f"Unknown mechanism: {mechanism}")
+
+    order = np.argsort(-scores, kind="stable")
+    winner = int(order[0])
+    runner_up = int(order[1]) if len(order) > 1 else winner
+    margin_gradient = jacobian[winner] - jacobian[runner_up]
+
+    flip_changes, flip_candidates = _flip_changes(scores, jacobian, weights, winner)
+
+    return WeightSensitivity(mechanism,
+                             list(electorate.candidates),
+                             list(electorate.credentials),
+                             scores,
+                             jacobian,
+                             electorate.candidates[winner],
+                             electorate.candidates[runner_up],
+                             float(scores[winner] - scores[runner_up]),
+                             margin_gradient,
+                             flip_changes,
+                             [electorate.candidates[c] if c >= 0 else None for c in flip_candidates],
+                             mechanism in LINEAR_MECHANISMS)
+
+
+def _quadratic_credibility_jacobian(electorate, weights, proportions):
+    # Score of candidate c is root_c ** 2, with root_c = sum over voters of sqrt(points_i * proportion_ic),
+    # and points_i = total * voter_weight_i / sum of voter weights.
+    voter_weights = electorate.credential_matrix @ weights
+    total_weight = voter_weights.sum()
+    points = quadratic_credibility_points(voter_weights)
+    scores = quadratic_credibility_scores(points[:, None] * proportions)
+    if total_weight == 0:
+        return scores, np.zeros((len(electorate.candidates), len(weights)))
+
+    roots = np.sqrt(scores)
+    # d root_c / d points_i. Voters without points have no finite derivative and are left out.
+    root_slopes = np.divide(np.sqrt(proportions), 2 * np.sqrt(points)[:, None],
+                            out=np.zeros_like(proportions), where=points[:, None] > 0)
+    # d points_i / d weight_j = total / S * (C_ij - voter_weight_i * column_sum_j / S)
+    column_sums = electorate.credential_matrix.sum(axis=0)
+    root_jacobian = (DEFAULT_TOTAL_POINTS / total_weight) * (
+        root_slopes.T @ electorate.credential_matrix
+        - np.outer(root_slopes.T @ voter_weights, column_sums) / total_weight)
+
+    return scores, 2 * roots[:, None] * root_jacobian
+
+
+def _group_hug_jacobian(electorate, weights, group_hug, step):
+    # Central differences, with every weight moved up and down in one batch
+    steps = step * np.maximum(np.abs(weights), 1.0)
+    moved = np.concatenate([weights + np.diag(steps), weights - np.diag(steps)])
+    shifted, _ = group_hug.vote_arrays(electorate, nft_weights=moved, rounded=False)
+    scores, _ = group_hug.vote_arrays(electorate, nft_weights=weights, rounded=False)
+
+    up, down = shifted[:len(weights)], shifted[len(weights):]
+    jacobian = ((up - down) / (2 * steps[:, None])).T
+    return scores, jacobian
+
+
+def _flip_changes(scores, jacobian, weights, winner):
+    # For each rival c and credential j, margin_c + change * (J[winner, j] - J[c, j]) = 0
+    # at change = -margin_c / slope. Keep changes that leave the weight >= 0.
+    margins = scores[winner] - scores
+    slopes = jacobian[winner][None, :] - jacobian
+    with np.errstate(divide="ignore", invalid="ignore"):
+        changes = -margins[:, None] / slopes
+    allowed = (slopes != 0) & (weights[None, :] + changes >= 0)
+    allowed[winner] = False
+    changes = np.where(allowed, changes, np.nan)
+
+    flip_changes = np.full(len(weights), np.nan)
+    flip_candidates = np.full(len(weights), -1)
+    reachable = ~np.all(np.isnan(changes), axis=0)
+    if reachable.any():
+        closest = np.nanargmin(np.abs(changes[:, reachable]), axis=0)
+        flip_changes[reachable] = changes[closest, np.flatnonzero(reachable)]
+        flip_candidates[reachable] = closest
+    return flip_changes, flip_candidates
@@ -0,0 +1,272 @@
+"""sybil_resistance.py
+
+Simulates sybil attacks, where a voter splits their credentials across k fresh addresses,
+and measures how much each mechanism rewards the split.
+
+Splits are not applied by copying voters. Instead, each voter gets a multiplicity: the number
+of addresses their credentials are spread over. A whole sweep over k is then one batch of
+multiplicity rows, scored at once by the array versions of the mechanisms.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Literal, Optional, Sequence
+
+import numpy as np
+
+from mechanisms.electorate import (Electorate,
+                                   LINEAR_MECHANISMS,
+                                   weighted_scores,
+                                   quadratic_credibility_points,
+                                   quadratic_credibility_scores)
+from mechanisms.group_hug_mechanism import GroupHug
+from mechanisms.group_mechanism import GroupMechanism
+from mechanisms.rank_n_slide_mechanism import DEFAULT_NFT_WEIGHTS
+
+DEFAULT_SPLITS = (1, 2, 3, 5, 10, 20)
+
+
+@dataclass
+class SybilAttackResult:
+    """
+    The outcome of splitting one set of attackers over a range of k.
+
+    Attributes:
+        splits (np.ndarray): The values of k that were simulated.
+        attackers (np.ndarray): Row indices of the attacking voters in the electorate.
+        favoured_candidate (str): The candidate the attackers support the most, together.
+        shares (Dict[str, np.ndarray]): For each mechanism, a (splits x candidates) array
+            of each candidate's share of the total score.
+        gains (Dict[str, np.ndarray]): For each mechanism, the attack gain curve:
+            the change in the favoured candidate's share, compared to k = 1.
+        winners (Dict[str, List[str]]): For each mechanism, the winner at each k.
+    """
+    splits: np.ndarray
+    attackers: np.ndarray
+    favoured_candidate: str
+    shares: Dict[str, np.ndarray]
+    gains: Dict[str, np.ndarray]
+    winners: Dict[str, List[str]]
+
+
+def select_attackers(electorate: Electorate,
+                     credential_weights: Dict[str, float] = DEFAULT_NFT_WEIGHTS,
+                     strategy: Literal["top", "random", "all"] = "top",
+                     num_attackers: int = 1,
+                     seed: Optional[int] = None) -> np.ndarray:
+    """
+    Picks which voters attack.
+
+    Parameters:
+    - electorate: The electorate to pick from.
+    - credential_weights: Used to rank voters when strategy is "top".
+    - strategy: "top" for the num_attackers heaviest voters, "random" for num_attackers
+        voters picked uniformly, "all" for every voter.
+    - num_attackers: How many attackers to pick. Ignored when strategy is "all".
+    - seed: Seed for the "random" strategy.
+
+    Returns:
+    - np.ndarray: Row indices of the attackers.
+    """
+    if strategy == "all":
+        return np.arange(electorate.num_voters)
+    if strategy == "top":
+        weights = electorate.voter_weights(credential_weights)
+        # Stable sort, so that equally weighted voters keep their original order
+        return np.argsort(-weights, kind="stable")[:num_attackers]
+    if strategy == "random":
+        rng = np.random.default_rng(seed)
+        return rng.choice(electorate.num_voters, size=num_attackers, replace=False)
+    raise ValueError(f"Unknown attacker selection strategy: {strategy}")
+
+
+def split_multiplicity(electorate: Electorate,
+                       attackers: np.ndarray,
+                       splits: Sequence[int],
+                       cap_by_tokens: bool = True) -> np.ndarray:
+    """
+    Returns a (splits x voters) array with the number of addresses each voter uses for each k.
+
+    Non-attackers always use one address. Since the electorate only contains addresses that hold
+    at least one credential, by default an attacker cannot use more addresses than they hold
+    tokens. Set cap_by_tokens to False to allow empty addresses to vote.
+    """
+    splits = np.asarray(splits, dtype=float)
+    multiplicity = np.ones((len(splits), electorate.num_voters))
+    attacker_splits = np.broadcast_to(splits[:, None], (len(splits), len(attackers)))
+    if cap_by_tokens:
+        tokens = electorate.credential_matrix[attackers].sum(axis=1)
+        attacker_splits = np.minimum(attacker_splits, np.maximum(tokens, 1))
+    multiplicity[:, attackers] = attacker_splits
+    return multiplicity
+
+
+def quadratic_credibility_multiplicity(electorate: Electorate,
+                                       multiplicity: np.ndarray,
+                                       credential_weights: Dict[str, float] = DEFAULT_NFT_WEIGHTS) -> np.ndarray:
+    """
+    Turns the number of addresses of each voter into the multiplicity that quadratic_credibility_scores
+    needs, for splits by whole tokens.
+
+    A voter of weight w whose tokens are spread over addresses of weights w_1 .. w_k contributes
+    (sqrt(w_1) + ... + sqrt(w_k)) / sqrt(w) times as much to each candidate as before, i.e. the
+    multiplicity is that factor squared. Tokens are spread heaviest first, each to the lightest address
+    so far, which is as even as whole tokens allow. The multiplicity equals the number of addresses only
+    when all of a voter's tokens have the same weight: FUND_AUTHOR and ETHCC_23 split over two addresses
+    give a factor of about 1.19, not sqrt(2).
+
+    All voters and splits are spread together, one token per step, so the number of steps is the
+    largest number of tokens any attacker holds.
+
+    Parameters:
+    - electorate: The electorate.
+    - multiplicity: A (splits x voters) array of address counts, e.g. from split_multiplicity.
+    - credential_weights: The NFT weights.
+
+    Returns:
+    - np.ndarray: The (splits x voters) multiplicity for quadratic credibility.
+    """
+    weights = electorate.weight_vector(credential_weights)
+    voter_weights = electorate.credential_matrix @ weights
+    result = np.ones_like(multiplicity, dtype=float)
+
+    # Only (split, voter) pairs with more than one address need tokens spread
+    needs_spread = (multiplicity > 1) & (voter_weights > 0)
+    split_rows, voters = np.nonzero(needs_spread)
+    if len(voters) == 0:
+        return result
+
+    spread_voters = np.flatnonzero(needs_spread.any(axis=0))
+    tokens = _token_weights(electorate.credential_matrix[spread_voters], weights)
+    token_rows = np.zeros(electorate.num_voters, dtype=int)
+    token_rows[spread_voters] = np.arange(len(spread_voters))
+
+    spread = _spread_tokens(tokens[token_rows[voters]], multiplicity[split_rows, voters].astype(int))
+    result[split_rows, voters] = spread / voter_weights[voters]
+    return result
+
+
+def _token_weights(credential_matrix, weights):
+    # The weight of each voter's tokens, heaviest first, as a (voters x most tokens) array padded with 0
+    order = np.argsort(-weights, kind="stable")
+    cumulative = np.cumsum(np.maximum(np.round(credential_matrix[:, order]), 0).astype(int), axis=1)
+    padded_weights = np.append(weights[order], 0.0)
+    tokens = np.zeros((len(credential_matrix), int(cumulative[:, -1].max(initial=0))))
+    for token in range(tokens.shape[1]):
+        tokens[:, token] = padded_weights[(cumulative <= token).sum(axis=1)]
+    return tokens
+
+
+def _spread_tokens(tokens, addresses):
+    # For every row at once, hands out the tokens heaviest first, each to the lightest address so far,
+    # and returns the squared sum of the square roots of the address weights.
+    # Unused address slots are infinitely heavy, so they are never picked.
+    loads = np.where(np.arange(addresses.max()) < addresses[:, None], 0.0, np.inf)
+    rows = np.arange(len(tokens))
+    for token in range(tokens.shape[1]):
+        loads[rows, np.argmin(loads, axis=1)] += tokens[:, token]
+    return np.square(np.sqrt(np.where(np.isfinite(loads), loads, 0.0)).sum(axis=1))
+
+
+def simulate_sybil_attack(electorate: Electorate,
+                          attackers: np.ndarray,
+                          splits: Sequence[int] = DEFAULT_SPLITS,
+                          credential_weights: Dict[str, float] = DEFAULT_NFT_WEIGHTS,
+                          group_hug: Optional[GroupMechanism] = None,
+                          cap_by_tokens: bool = True) -> SybilAttackResult:
+    """
+    Splits the attackers across k addresses for each k in splits, and scores every mechanism.
+
+    How a split changes each mechanism:
+    - Weighted plurality, PercentageAllocation and RankAndSlide are linear in credentials, so the
+      k addresses together hold the same weight as before. Their gain is 0 by construction.
+    - Quadratic credibility gives each address the points of the tokens it holds. Spreading whole tokens
+      over k addresses turns sqrt(points) into the sum of the square roots of each address's points,
+      see quadratic_credibility_multiplicity. That is at most sqrt(k * points), for tokens of equal weight.
+    - GroupHug counts every address once in the community group, and every address holding an
+      expert NFT once in the experts group. Intellectuals and participants are linear.
+      The same applies to any GroupMechanism, by the membership rule of each group.
+
+    Parameters:
+    - electorate: The electorate under attack.
+    - attackers: Row indices of the attacking voters, e.g. from select_attackers.
+    - splits: The values of k to simulate. k = 1 is always used as the baseline.
+    - credential_weights: The NFT weights for weighted plurality, RankAndSlide and QCV points.
+    - group_hug: The GroupHug, or other GroupMechanism, to score. Defaults to GroupHug().
+    - cap_by_tokens: See split_multiplicity.
+
+    Returns:
+    - SybilAttackResult: The score shares, winners and attack gain curves.
+    """
+    attackers = np.asarray(attackers, dtype=int)
+    splits = np.array(sorted(set(splits) | {1}))
+    multiplicity = split_multiplicity(electorate, attackers, splits, cap_by_tokens)
+
+    proportions = electorate.proportions()
+    weights = electorate.voter_weights(credential_weights)
+
+    # The candidate the attackers support the most, adding up their weighted ballots
+    favoured = int(np.argmax(weighted_scores(weights[attackers], proportions[attackers])))
+
+    scores = {}
+    linear = np.broadcast_to(weighted_scores(weights, proportions),
+                             (len(splits), len(electorate.candidates)))
+    for name in LINEAR_MECHANISMS:
+        scores[name] = linear
+
+    allocations = quadratic_credibility_points(weights)[:, None] * proportions
+    qcv_multiplicity = quadratic_credibility_multiplicity(electorate, multiplicity, credential_weights)
+    scores["quadratic_credibility"] = quadratic_credibility_scores(allocations, qcv_multiplicity)
+
+    if group_hug is None:
+        group_hug = GroupHug()
+
+    # Every address counts in one-person-one-vote groups, but in "any_of" groups
+    # only addresses that hold one of the group's NFTs count
+    group_multiplicities = {}
+    for group in group_hug.groups:
+        if group.rule == "one_person_one_vote":
+            group_multiplicities[group.name] = multiplicity
+        elif group.rule == "any_of":
+            columns = [j for j, nft in enumerate(electorate.credentials) if nft in group.credentials]
+            group_tokens = electorate.credential_matrix[:, columns].sum(axis=1)
+            group_multiplicities[group.name] = np.minimum(multiplicity, np.maximum(group_tokens, 1))
+    scores["group_hug"], _ = group_hug.vote_arrays(electorate, group_multiplicities)
+
+    shares, gains, winners = {}, {}, {}
+    for name, score in scores.items():
+        total = score.sum(axis=1, keepdims=True)
+        share = np.divide(score, total, out=np.zeros_like(score, dtype=float), where=total != 0)
+        shares[name] = share
+        gains[name] = share[:, favoured] - share[0, favoured]
+        winners[name] = [electorate.candidates[j] for j in np.argmax(score, axis=1)]
+
+    return SybilAttackResult(splits, attackers, electorate.candidates[favoured],
+                             shares, gains, winners)
+
+
+def sweep_sybil_attacks(electorate: Electorate,
+                        attacker_sets: Dict[str, np.ndarray],
+                        splits: Sequence[int] = DEFAULT_SPLITS,
+                        credential_weights: Dict[str, float] = DEFAULT_NFT_WEIGHTS,
+                        group_hug: Optional[GroupMechanism] = None,
+                        cap_by_tokens: bool = True,
+                        max_workers: Optional[int] = None) -> Dict[str, SybilAttackResult]:
+    """
+    Runs simulate_sybil_attack for several attacker sets in a process pool. Spreading tokens
+    over addresses is mostly indexed array updates, which hold the GIL, so threads do not help.
+
+    Parameters:
+    - attacker_sets: The attackers to simulate, by name.
+    - max_workers: The number of worker processes.
+    The other parameters are the same as for simulate_sybil_attack. group_hug must be picklable.
+
+    Returns:
+    - Dict[str, SybilAttackResult]: The result for each named attacker set.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(simulate_sybil_attack,
+                                         electorate, attackers, splits,
+                                         credential_weights, group_hug, cap_by_tokens)
+                   for name, attackers in attacker_sets.items()}
+        return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,273 @@
+"""weight_optimizer.py
+
+Searches the NFT weight table for weightings that make the electorate less concentrated,
+instead of tuning weights by hand until the Nakamoto coefficient and Gini look acceptable.
+
+The search is a projected random search. Each round, every weighting on the current Pareto front
+has children that change the weight of one credential (or one category of credentials), clipped
+back into the allowed bounds. A child's voter weights are its parent's voter weights plus the
+change times that credential's column of the credential matrix, so a whole round of children is
+one sparse matrix product. The concentration metrics of the round are then computed together.
+They are recomputed in full, by sorting every child's voter weights, rather than updated from the
+parent: each child moves a different column's voters, so an incremental update would be a loop
+over children, and one batched sort of the round is as fast for electorates of a few thousand voters.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from mechanisms.electorate import Electorate
+from metrics.plutocracy import nakamoto_coefficients, gini_coefficients, max_voter_shares
+
+try:
+    from scipy import sparse
+except ImportError:  # Dense matrices work as well, only slower for large electorates
+    sparse = None
+
+DEFAULT_ROUNDS = 100
+DEFAULT_BATCH_SIZE = 512
+DEFAULT_STEP = 0.25
+DEFAULT_MAX_FRONT = 200
+
+# The objectives, and whether larger values are better
+OBJECTIVES = {"nakamoto": True,
+              "gini": False,
+              "max_share": False,
+              "change": False}
+
+
+@dataclass
+class WeightingFront:
+    """
+    The Pareto front of weightings found by optimize_weights.
+
+    Attributes:
+        credentials (List[str]): The credential names, in column order of weights.
+        weights (np.ndarray): A (front x credentials) array with one weighting per row.
+        nakamoto (np.ndarray): The Nakamoto coefficient of each weighting.
+        gini (np.ndarray): The Gini coefficient of voter weights for each weighting.
+        max_share (np.ndarray): The largest share of the total weight held by one voter.
+        change (np.ndarray): How far each weighting is from the initial weights, as the sum of
+            absolute changes divided by the sum of initial weights.
+        feasible (np.ndarray): Whether each weighting meets all targets.
+        evaluated (int): How many weightings were scored during the search.
+    """
+    credentials: List[str]
+    weights: np.ndarray
+    nakamoto: np.ndarray
+    gini: np.ndarray
+    max_share: np.ndarray
+    change: np.ndarray
+    feasible: np.ndarray
+    evaluated: int
+
+    def weight_dicts(self) -> List[Dict[str, float]]:
+        """Returns each weighting on the front as a {credential: weight} dictionary."""
+        return [dict(zip(self.credentials, row.tolist())) for row in self.weights]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Returns the front as a table, with one row per weighting."""
+        table = pd.DataFrame(self.weights, columns=self.credentials)
+        table.insert(0, "feasible", self.feasible)
+        table.insert(0, "change", self.change)
+        table.insert(0, "max_share", self.max_share)
+        table.insert(0, "gini", self.gini)
+        table.insert(0, "nakamoto", self.nakamoto)
+        return table
+
+
+def load_credential_table(file_name: str) -> Tuple[Dict[str, float], Dict[str, str]]:
+    """
+    Reads a credential table such as data/votingWeightsComm.csv.
+
+    Returns:
+    - Dict[str, float]: The weight of each credential, by CodeName.
+    - Dict[str, str]: The category of each credential (e.g. POK, POE), by CodeName.
+    """
+    table = pd.read_csv(file_name, skipinitialspace=True)
+    table["CodeName"] = table["CodeName"].str.strip()
+    table["Category"] = table["Category"].str.strip()
+    weights = dict(zip(table["CodeName"], table["Weight"].astype(float)))
+    categories = dict(zip(table["CodeName"], table["Category"]))
+    return weights, categories
+
+
+def optimize_weights(electorate: Electorate,
+                     initial_weights: Dict[str, float],
+                     bounds: Optional[Dict[str, Tuple[float, float]]] = None,
+                     categories: Optional[Dict[str, str]] = None,
+                     category_bounds: Optional[Dict[str, Tuple[float, float]]] = None,
+                     tie_categories: bool = False,
+                     min_nakamoto: Optional[int] = None,
+                     max_gini: Optional[float] = None,
+                     max_share: Optional[float] = None,
+                     rounds: int = DEFAULT_ROUNDS,
+                     batch_size: int = DEFAULT_BATCH_SIZE,
+                     step: float = DEFAULT_STEP,
+                     max_front: int = DEFAULT_MAX_FRONT,
+                     seed: Optional[int] = None) -> WeightingFront:
+    """
+    Searches for credential weightings that trade off decentralization against change.
+
+    Parameters:
+    - electorate: The electorate whose credentials are weighted.
+    - initial_weights: The starting weight of each credential. Missing credentials start at 0.
+    - bounds: Optional (lower, upper) bounds per credential. Defaults to 0 and three times
+        the largest initial weight.
+    - categories: Optional category of each credential, e.g. from load_credential_table.
+    - category_bounds: Optional (lower, upper) bounds for every credential in a category.
+        Where both are given, the tighter bound applies.
+    - tie_categories: If True, all credentials of a category keep the same weight as each other.
+        They start from the mean initial weight of the category.
+    - min_nakamoto: Target: the Nakamoto coefficient should be at least this.
+    - max_gini: Target: the Gini coefficient should be at most this.
+    - max_share: Target: no voter should hold more than this share of the total weight.
+    - rounds: The number of rounds of the search.
+    - batch_size: The number of weightings scored per round.
+    - step: The size of a change, relative to the upper bound of the credential.
+    - max_front: The largest number of weightings kept on the front between rounds.
+    - seed: Seed for the random changes.
+
+    Returns:
+    - WeightingFront: The non-dominated weightings. If any weighting met every target,
+        only weightings that meet every target are returned.
+    """
+    rng = np.random.default_rng(seed)
+    credentials = electorate.credentials
+    categories = categories or {}
+
+    # Parameters are credentials, or categories when they are tied together
+    if tie_categories:
+        blocks = list(dict.fromkeys(categories.get(credential, credential) for credential in credentials))
+        block_of = [blocks.index(categories.get(credential, credential)) for credential in credentials]
+    else:
+        blocks = list(credentials)
+        block_of = list(range(len(credentials)))
+    assignment = np.zeros((len(credentials), len(blocks)))
+    assignment[np.arange(len(credentials)), block_of] = 1
+
+    initial = electorate.weight_vector(initial_weights)
+    lower, upper = _parameter_bounds(credentials, initial, bounds, categories, category_bounds, assignment)
+    initial_parameters = np.clip((initial @ assignment) / assignment.sum(axis=0), lower, upper)
+
+    # Voter weights are credential_matrix @ weights = block_matrix @ parameters
+    block_matrix = electorate.credential_matrix @ assignment
+    if sparse is not None:
+        block_matrix = sparse.csr_matrix(block_matrix)
+    targets = (min_nakamoto, max_gini, max_share)
+
+    parameters = initial_parameters[None, :]
+    voter_weights = (block_matrix @ parameters.T).T
+    scores = _score(voter_weights, parameters @ assignment.T, initial, targets)
+    evaluated = 1
+
+    for _ in range(rounds):
+        # Each child changes one parameter of a parent on the front
+        parents = rng.integers(len(parameters), size=batch_size)
+        changed = rng.integers(len(blocks), size=batch_size)
+        child_parameters = parameters[parents].copy()
+        old_values = child_parameters[np.arange(batch_size), changed]
+        new_values = np.clip(old_values + rng.normal(0, step, batch_size) * np.maximum(upper[changed], 1e-9),
+                             lower[changed], upper[changed])
+        child_parameters[np.arange(batch_size), changed] = new_values
+
+        # Incremental update: parent voter weights plus the change along one column
+        changes = np.zeros((len(blocks), batch_size))
+        changes[changed, np.arange(batch_size)] = new_values - old_values
+        if sparse is not None:
+            changes = sparse.csc_matrix(changes)
+        moved = block_matrix @ changes
+        if sparse is not None:
+            moved = moved.toarray()
+        child_voter_weights = voter_weights[parents] + moved.T
+
+        child_scores = _score(child_voter_weights, child_parameters @ assignment.T, initial, targets)
+        evaluated += batch_size
+
+        parameters = np.vstack([parameters, child_parameters])
+        voter_weights = np.vstack([voter_weights, child_voter_weights])
+        scores = {name: np.concatenate([scores[name], child_scores[name]]) for name in scores}
+
+        keep = _pareto_front(scores, max_front)
+        parameters, voter_weights = parameters[keep], voter_weights[keep]
+        scores = {name: values[keep] for name, values in scores.items()}
+
+    order = np.lexsort((scores["change"], -scores["nakamoto"]))
+    return WeightingFront(list(credentials),
+                          (parameters @ assignment.T)[order],
+                          scores["nakamoto"][order],
+                          scores["gini"][order],
+                          scores["max_share"][order],
+                          scores["change"][order],
+                          scores["feasible"][order],
+                          evaluated)
+
+
+def _parameter_bounds(credentials, initial, bounds, categories, category_bounds, assignment):
+    # Bounds per credential, tightened by category bounds, then per parameter block
+    default_upper = 3 * max(initial.max(), 1.0)
+    lower = np.zeros(len(credentials))
+    upper = np.full(len(credentials), default_upper)
+    for j, credential in enumerate(credentials):
+        if bounds and credential in bounds:
+            lower[j], upper[j] = bounds[credential]
+        category = categories.get(credential)
+        if category_bounds and category in category_bounds:
+            category_lower, category_upper = category_bounds[category]
+            lower[j] = max(lower[j], category_lower)
+            upper[j] = min(upper[j], category_upper)
+
+    # A block must satisfy the bounds of every credential in it
+    in_block = assignment.T > 0
+    block_lower = np.where(in_block, lower, -np.inf).max(axis=1)
+    block_upper = np.where(in_block, upper, np.inf).min(axis=1)
+    if np.any(block_lower > block_upper):
+        raise ValueError("The bounds leave no allowed weight for some credentials.")
+    return block_lower, block_upper
+
+
+def _score(voter_weights, weights, initial, targets):
+    # Nakamoto, Gini and max share sort each row of voter_weights again, see the module docstring
+    min_nakamoto, max_gini, max_share = targets
+    scores = {"nakamoto": nakamoto_coefficients(voter_weights),
+              "gini": gini_coefficients(voter_weights),
+              "max_share": max_voter_shares(voter_weights),
+              "change": np.abs(weights - initial).sum(axis=1) / max(initial.sum(), 1e-9)}
+
+    feasible = np.ones(len(voter_weights), dtype=bool)
+    if min_nakamoto is not None:
+        feasible &= scores["nakamoto"] >= min_nakamoto
+    if max_gini is not None:
+        feasible &= scores["gini"] <= max_gini
+    if max_share is not None:
+        feasible &= scores["max_share"] <= max_share
+    scores["feasible"] = feasible
+    return scores
+
+
+def _pareto_front(scores, max_front):
+    # Indices of the non-dominated rows. Feasible rows come first: if there are any,
+    # infeasible rows are dropped.
+    candidates = np.flatnonzero(scores["feasible"])
+    if len(candidates) == 0:
+        candidates = np.arange(len(scores["feasible"]))
+
+    # Turn every objective into one to minimize
+    values = np.column_stack([-scores[name][candidates] if larger_is_better else scores[name][candidates]
+                              for name, larger_is_better in OBJECTIVES.items()])
+    values, unique = np.unique(values, axis=0, return_index=True)
+    candidates = candidates[unique]
+
+    no_worse = (values[:, None, :] <= values[None, :, :]).all(axis=2)
+    better = (values[:, None, :] < values[None, :, :]).any(axis=2)
+    dominated = (no_worse & better).any(axis=0)
+    front = candidates[~dominated]
+
+    if len(front) > max_front:
+        # Keep an even spread along the most important objective
+        front = front[np.argsort(-scores["nakamoto"][front], kind="stable")]
+        front = front[np.linspace(0, len(front) - 1, max_front).astype(int)]
+    return front
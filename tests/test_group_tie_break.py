@@ -0,0 +1,66 @@
+"""test_group_tie_break.py
+
+Checks that ranked and budget-filling results of GroupHug break ties the way its calculate method does.
+"""
+
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from mechanisms.group_hug_mechanism import GroupHug
+from mechanisms.ranking import UnresolvedTieError
+
+NFT_WEIGHTS = {"FUND_MOD_1": 1.0, "LIVE_TRACK_1": 1.0}
+
+
+def _winners(group_hug, voters, voter_choices):
+    # The winner from calculate, rank and allocate_budget, or None where a tie could not be broken
+    def winner(run):
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                return run()
+        except UnresolvedTieError:
+            return None
+
+    candidates = set(voter_choices.values())
+    costs = {candidate: 1.0 for candidate in candidates}
+    return (winner(lambda: group_hug.calculate(voters, voter_choices)[0]),
+            winner(lambda: group_hug.rank(voters, voter_choices, k=1).winner()),
+            winner(lambda: group_hug.rank(voters, voter_choices).winner()),
+            winner(lambda: group_hug.allocate_budget(voters, voter_choices, costs, 1.0).funded[0]))
+
+
+def test_three_way_tie_is_resolved_by_the_community():
+    # The experts split between B and C, so they cannot resolve the tie, and the community picks A
+    group_hug = GroupHug(nft_weights=NFT_WEIGHTS)
+    voters = {"v0": {"FUND_AUTHOR": True, "FUND_MOD_1": True},
+              "v1": {"FUND_AUTHOR": True, "FUND_MOD_1": True},
+              "v2": {"FUND_MOD_1": True},
+              "v3": {"FUND_MOD_1": True}}
+    voter_choices = {"v0": "B", "v1": "C", "v2": "A", "v3": "A"}
+
+    assert _winners(group_hug, voters, voter_choices) == ("A", "A", "A", "A")
+
+
+def test_unresolved_tie_raises():
+    group_hug = GroupHug(nft_weights=NFT_WEIGHTS)
+    voters = {"v0": {"FUND_AUTHOR": True}, "v1": {"FUND_AUTHOR": True}}
+    voter_choices = {"v0": "A", "v1": "B"}
+
+    assert _winners(group_hug, voters, voter_choices) == (None, None, None, None)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_elections_match_calculate(seed):
+    rng = np.random.default_rng(seed)
+    group_hug = GroupHug(nft_weights={**NFT_WEIGHTS, "ETHCC_23": 2.0})
+    credentials = ["FUND_AUTHOR", "FUND_MOD_1", "LIVE_TRACK_1", "ETHCC_23", "SPEAKER_ETHCC_PARIS23"]
+    for _ in range(200):
+        voters = {f"v{i}": {credential: bool(rng.random() < 0.4) for credential in credentials}
+                  for i in range(rng.integers(2, 7))}
+        voter_choices = {voter: str(rng.choice(["A", "B", "C"])) for voter in voters}
+
+        calculated, *ranked = _winners(group_hug, voters, voter_choices)
+        assert ranked == [calculated] * 3